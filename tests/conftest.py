@@ -1,5 +1,7 @@
 import os
 
+import pytest
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 root_dir_content = os.listdir(BASE_DIR)
 PROJECT_DIR_NAME = 'yatube'
@@ -37,3 +39,12 @@ pytest_plugins = [
     'tests.fixtures.fixture_user',
     'tests.fixtures.fixture_data',
 ]
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_call(item):
+    # Миниатюры создаются в фоновом пуле: дожидаемся их до того, как
+    # фикстуры удалят временный MEDIA_ROOT и очистят базу.
+    yield
+    from posts.thumbnails import wait_for_thumbnails
+    wait_for_thumbnails()
@@ -0,0 +1,77 @@
+import atexit
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class Counters:
+    """Счетчики статистики в общем кэше CORE_COUNTERS_CACHE.
+
+    Приращения копятся в памяти процесса и уходят в общий кэш не чаще
+    раза в CORE_COUNTERS_FLUSH_INTERVAL секунд: счетчик, который растет
+    на каждом запросе, не должен брать блокировку записи общего кэша.
+    Накопленное уходит по таймеру и при выходе процесса, даже если новых
+    приращений больше не будет.
+    Двухуровневый кэш для них не годится: его incr еще и повышает
+    штамп корзины, сбрасывая соседние записи в памяти всех процессов.
+    """
+    def __init__(self, key, names):
+        self.key = key
+        self.names = names
+        self._pending = {}
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+        self._timer = None
+        atexit.register(self.flush)
+
+    @property
+    def cache(self):
+        return caches[settings.CORE_COUNTERS_CACHE]
+
+    def _keys(self):
+        return [self.key.format(name) for name in self.names]
+
+    def add(self, name, delta=1):
+        with self._lock:
+            self._pending[name] = self._pending.get(name, 0) + delta
+            wait = settings.CORE_COUNTERS_FLUSH_INTERVAL - (
+                time.monotonic() - self._flushed
+            )
+            if wait > 0 and self._timer is None:
+                self._timer = threading.Timer(wait, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if wait <= 0:
+            self.flush()
+
+    def flush(self):
+        """Переносит накопленные приращения в общий кэш."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed = time.monotonic()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        for name, delta in pending.items():
+            key = self.key.format(name)
+            try:
+                self.cache.incr(key, delta)
+            except ValueError:
+                if not self.cache.add(key, delta, None):
+                    self.cache.incr(key, delta)
+
+    def get(self):
+        """Значения счетчиков; приращения других процессов могут
+        запаздывать на CORE_COUNTERS_FLUSH_INTERVAL."""
+        self.flush()
+        stats = self.cache.get_many(self._keys())
+        return {
+            name: stats.get(self.key.format(name), 0) for name in self.names
+        }
+
+    def reset(self):
+        with self._lock:
+            self._pending = {}
+        self.cache.delete_many(self._keys())
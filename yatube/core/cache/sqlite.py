@@ -0,0 +1,278 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS cache (
+        key TEXT PRIMARY KEY,
+        value BLOB NOT NULL,
+        expires REAL,
+        accessed REAL NOT NULL,
+        size INTEGER NOT NULL
+    ) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+    '''CREATE TABLE IF NOT EXISTS cache_size (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        total INTEGER NOT NULL
+    )''',
+    'INSERT OR IGNORE INTO cache_size VALUES (0, 0)',
+    '''CREATE TRIGGER IF NOT EXISTS cache_size_insert AFTER INSERT ON cache
+    BEGIN
+        UPDATE cache_size SET total = total + NEW.size;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS cache_size_delete AFTER DELETE ON cache
+    BEGIN
+        UPDATE cache_size SET total = total - OLD.size;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS cache_size_update
+    AFTER UPDATE OF size ON cache
+    BEGIN
+        UPDATE cache_size SET total = total - OLD.size + NEW.size;
+    END''',
+)
+
+
+class SQLiteCache(BaseCache):
+    """Кэш в файле SQLite, общий для всех процессов на одной машине.
+
+    Файл открыт в режиме WAL: читатели не ждут писателя. Целые числа
+    хранятся как есть, поэтому incr — один атомарный UPDATE, а add
+    выполняется в транзакции BEGIN IMMEDIATE; на них можно строить
+    блокировки и счетчики. Когда объем данных превышает MAX_SIZE байт,
+    вытесняются записи, к которым дольше всего не обращались.
+
+    Настройки:
+        LOCATION — путь к файлу кэша;
+        OPTIONS['MAX_SIZE'] — предельный объем значений в байтах;
+        OPTIONS['TOUCH_INTERVAL'] — как часто, в секундах, обновлять
+        время обращения к записи при чтении.
+    """
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = location
+        self._max_size = int(options.get('MAX_SIZE', 64 * 1024 * 1024))
+        self._touch_interval = float(options.get('TOUCH_INTERVAL', 1))
+        self._local = threading.local()
+
+    @property
+    def _db(self):
+        # Соединение у каждого потока свое и не переживает fork().
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                db.execute(statement)
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    @contextmanager
+    def _write(self):
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def _dump(self, value):
+        if isinstance(value, int) and not isinstance(value, bool):
+            if -2 ** 63 <= value < 2 ** 63:
+                return value
+        return pickle.dumps(value, self.pickle_protocol)
+
+    @staticmethod
+    def _load(value):
+        if isinstance(value, int):
+            return value
+        return pickle.loads(value)
+
+    @staticmethod
+    def _size(key, value):
+        return len(key) + (8 if isinstance(value, int) else len(value))
+
+    def _store(self, db, key, value, expires, now):
+        if expires is not None and expires <= now:
+            db.execute('DELETE FROM cache WHERE key = ?', (key,))
+            return
+        value = self._dump(value)
+        # Не INSERT OR REPLACE: удаление при замене не запускает триггер
+        # cache_size_delete, и объем рос бы на каждой перезаписи.
+        db.execute(
+            'INSERT INTO cache VALUES (?, ?, ?, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET value = excluded.value, '
+            'expires = excluded.expires, accessed = excluded.accessed, '
+            'size = excluded.size',
+            (key, value, expires, now, self._size(key, value)),
+        )
+
+    def _evict(self, db):
+        (total,) = db.execute('SELECT total FROM cache_size').fetchone()
+        if total <= self._max_size:
+            return
+        now = time.time()
+        db.execute('DELETE FROM cache WHERE expires <= ?', (now,))
+        # Пересчитываем объем по данным: счетчик в файлах, записанных
+        # прежними версиями, мог разойтись с ними.
+        (total,) = db.execute(
+            'SELECT coalesce(sum(size), 0) FROM cache'
+        ).fetchone()
+        db.execute('UPDATE cache_size SET total = ?', (total,))
+        # Освобождаем с запасом, чтобы не вытеснять на каждой записи.
+        excess = total - self._max_size * 0.9
+        victims = []
+        for key, size in db.execute(
+            'SELECT key, size FROM cache ORDER BY accessed'
+        ):
+            if excess <= 0:
+                break
+            victims.append(key)
+            excess -= size
+        db.executemany(
+            'DELETE FROM cache WHERE key = ?', [(key,) for key in victims]
+        )
+
+    def get_many(self, keys, version=None):
+        key_map = {}
+        for key in keys:
+            full_key = self.make_key(key, version=version)
+            self.validate_key(full_key)
+            key_map[full_key] = key
+        if not key_map:
+            return {}
+        now = time.time()
+        placeholders = ', '.join('?' * len(key_map))
+        rows = self._db.execute(
+            f'SELECT key, value, expires, accessed FROM cache '
+            f'WHERE key IN ({placeholders})',
+            list(key_map),
+        ).fetchall()
+        result, touched = {}, []
+        for key, value, expires, accessed in rows:
+            if expires is not None and expires <= now:
+                continue
+            result[key_map[key]] = self._load(value)
+            if accessed < now - self._touch_interval:
+                touched.append(key)
+        if touched:
+            placeholders = ', '.join('?' * len(touched))
+            self._db.execute(
+                f'UPDATE cache SET accessed = ? WHERE key IN ({placeholders})',
+                [now] + touched,
+            )
+        return result
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        row = self._db.execute(
+            'SELECT 1 FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        ).fetchone()
+        return row is not None
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout=timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        expires = self.get_backend_timeout(timeout)
+        now = time.time()
+        with self._write() as db:
+            for key, value in data.items():
+                key = self.make_key(key, version=version)
+                self.validate_key(key)
+                self._store(db, key, value, expires, now)
+            self._evict(db)
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        expires = self.get_backend_timeout(timeout)
+        now = time.time()
+        with self._write() as db:
+            row = db.execute(
+                'SELECT 1 FROM cache WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (key, now),
+            ).fetchone()
+            if row is not None:
+                return False
+            self._store(db, key, value, expires, now)
+            self._evict(db)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        now = time.time()
+        with self._write() as db:
+            cursor = db.execute(
+                'UPDATE cache SET expires = ?, accessed = ? WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (self.get_backend_timeout(timeout), now, key, now),
+            )
+        return cursor.rowcount > 0
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        now = time.time()
+        with self._write() as db:
+            cursor = db.execute(
+                'UPDATE cache SET value = value + ?, accessed = ? '
+                'WHERE key = ? AND typeof(value) = \'integer\' '
+                'AND (expires IS NULL OR expires > ?)',
+                (delta, now, key, now),
+            )
+            if cursor.rowcount:
+                (value,) = db.execute(
+                    'SELECT value FROM cache WHERE key = ?', (key,)
+                ).fetchone()
+                return value
+            row = db.execute(
+                'SELECT value, expires FROM cache WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (key, now),
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            # Не целое в INTEGER значение (например, очень большое число).
+            value = self._load(row[0]) + delta
+            self._store(db, key, value, row[1], now)
+        return value
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_key(key, version=version) for key in keys]
+        for key in keys:
+            self.validate_key(key)
+        if not keys:
+            return
+        placeholders = ', '.join('?' * len(keys))
+        with self._write() as db:
+            db.execute(
+                f'DELETE FROM cache WHERE key IN ({placeholders})', keys
+            )
+
+    def clear(self):
+        with self._write() as db:
+            db.execute('DELETE FROM cache')
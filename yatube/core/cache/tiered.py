@@ -0,0 +1,220 @@
+import pickle
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.functional import cached_property
+
+STAMP_KEY = 'tiered:stamp:{}'
+IMMUTABLE = (str, bytes, int, float, bool, type(None))
+
+
+class TieredCache(BaseCache):
+    """Двухуровневый кэш: LRU в памяти процесса перед общим кэшем.
+
+    LOCATION — псевдоним общего кэша (второго уровня). Ключи разбиты
+    на BUCKETS корзин, у каждой корзины в общем кэше есть штамп версии;
+    любая запись или удаление повышает штамп своей корзины. Процесс
+    перечитывает все штампы одним get_many не реже раза в STALENESS
+    секунд и не отдает из памяти записи с устаревшим штампом, так что
+    изменение в одном процессе видно остальным не позже чем через
+    STALENESS секунд.
+
+    Настройки OPTIONS:
+        MAX_ENTRIES, MAX_BYTES — пределы первого уровня;
+        MAX_AGE — сколько секунд держать в памяти прочитанное из общего
+        кэша (его собственный TTL здесь неизвестен);
+        STALENESS — допустимое запаздывание инвалидации;
+        BUCKETS — число корзин со штампами.
+    """
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._alias = location
+        self._max_entries = int(options.get('MAX_ENTRIES', 1000))
+        self._max_bytes = int(options.get('MAX_BYTES', 16 * 1024 * 1024))
+        self._max_age = float(options.get('MAX_AGE', 300))
+        self._staleness = float(options.get('STALENESS', 1))
+        self._buckets = int(options.get('BUCKETS', 64))
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._stamps = None
+        self._stamps_checked = 0
+
+    @cached_property
+    def shared(self):
+        return caches[self._alias]
+
+    def _bucket(self, key):
+        return zlib.crc32(key.encode()) % self._buckets
+
+    def _stamp_keys(self):
+        return [STAMP_KEY.format(bucket) for bucket in range(self._buckets)]
+
+    def _current_stamps(self):
+        now = time.monotonic()
+        if self._stamps is not None and (
+            now - self._stamps_checked < self._staleness
+        ):
+            return self._stamps
+        keys = self._stamp_keys()
+        found = self.shared.get_many(keys)
+        for key in keys:
+            if key not in found:
+                # Начальный штамп от времени: после clear() общего кэша
+                # старые записи в памяти других процессов не совпадут.
+                self.shared.add(key, time.time_ns(), None)
+                found[key] = self.shared.get(key)
+        self._stamps = [found[key] for key in keys]
+        self._stamps_checked = now
+        return self._stamps
+
+    def _bump(self, keys):
+        buckets = {self._bucket(key) for key in keys}
+        for bucket in buckets:
+            stamp_key = STAMP_KEY.format(bucket)
+            try:
+                stamp = self.shared.incr(stamp_key)
+            except ValueError:
+                self.shared.add(stamp_key, time.time_ns(), None)
+                stamp = self.shared.get(stamp_key)
+            if self._stamps is not None:
+                self._stamps[bucket] = stamp
+
+    def _forget(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _remember(self, key, value, timeout):
+        if isinstance(value, IMMUTABLE):
+            stored, size = value, len(pickle.dumps(value))
+        else:
+            # Изменяемые объекты храним сериализованными: вызывающий код
+            # (например, middleware с ответом) не должен портить копию.
+            stored = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            size = len(stored)
+        if size > self._max_bytes:
+            return
+        max_age = self._max_age if timeout is None else min(
+            timeout, self._max_age
+        )
+        bucket = self._bucket(key)
+        entry = (
+            stored, not isinstance(value, IMMUTABLE), size,
+            bucket, self._current_stamps()[bucket],
+            time.monotonic() + max_age,
+        )
+        self._forget(key)
+        self._entries[key] = entry
+        self._bytes += size
+        while self._entries and (
+            len(self._entries) > self._max_entries
+            or self._bytes > self._max_bytes
+        ):
+            _, (_, _, size, _, _, _) = self._entries.popitem(last=False)
+            self._bytes -= size
+
+    def _recall(self, key, stamps, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        stored, pickled, _, bucket, stamp, expires = entry
+        if stamp != stamps[bucket] or expires <= now:
+            self._forget(key)
+            return False, None
+        self._entries.move_to_end(key)
+        return True, pickle.loads(stored) if pickled else stored
+
+    def _l1_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        return timeout
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        result, missing = {}, []
+        with self._lock:
+            stamps = self._current_stamps()
+            now = time.monotonic()
+            for key in keys:
+                found, value = self._recall(
+                    self.make_key(key, version), stamps, now
+                )
+                if found:
+                    result[key] = value
+                else:
+                    missing.append(key)
+        if missing:
+            fetched = self.shared.get_many(missing, version=version)
+            with self._lock:
+                for key, value in fetched.items():
+                    self._remember(self.make_key(key, version), value, None)
+            result.update(fetched)
+        return result
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version=version).get(key, default)
+
+    def has_key(self, key, version=None):
+        return self.shared.has_key(key, version=version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout=timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout=timeout, version=version)
+        with self._lock:
+            full_keys = {key: self.make_key(key, version) for key in data}
+            self._bump(full_keys.values())
+            for key, value in data.items():
+                if key in failed:
+                    self._forget(full_keys[key])
+                else:
+                    self._remember(
+                        full_keys[key], value, self._l1_timeout(timeout)
+                    )
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout=timeout, version=version)
+        if added:
+            full_key = self.make_key(key, version)
+            with self._lock:
+                self._bump([full_key])
+                self._remember(full_key, value, self._l1_timeout(timeout))
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout=timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.shared.incr(key, delta=delta, version=version)
+        full_key = self.make_key(key, version)
+        with self._lock:
+            self._bump([full_key])
+            self._forget(full_key)
+        return value
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.shared.delete_many(keys, version=version)
+        full_keys = [self.make_key(key, version) for key in keys]
+        with self._lock:
+            self._bump(full_keys)
+            for full_key in full_keys:
+                self._forget(full_key)
+
+    def clear(self):
+        self.shared.clear()
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._stamps = None
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+
+@register()
+def check_replica_pin(app_configs, **kwargs):
+    """Закрепление за основной базой должно пережить отставание реплики.
+
+    Реплику используют, пока ее отставание не больше CORE_REPLICA_MAX_LAG,
+    а проверяют его раз в CORE_REPLICA_CHECK_INTERVAL секунд. Если
+    закрепление короче, пользователь может не увидеть свою запись.
+    """
+    if not settings.CORE_READ_REPLICAS:
+        return []
+    lag = settings.CORE_REPLICA_MAX_LAG + settings.CORE_REPLICA_CHECK_INTERVAL
+    if settings.CORE_REPLICA_PIN_SECONDS >= lag:
+        return []
+    return [Error(
+        f'CORE_REPLICA_PIN_SECONDS меньше {lag} с — наибольшего '
+        f'отставания реплики, с которым она еще читается.',
+        hint='Задайте CORE_REPLICA_PIN_SECONDS не меньше '
+             'CORE_REPLICA_MAX_LAG + CORE_REPLICA_CHECK_INTERVAL.',
+        id='core.E001',
+    )]
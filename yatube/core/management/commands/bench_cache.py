@@ -0,0 +1,96 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from core.cache.sqlite import SQLiteCache
+
+VALUE = {'html': 'x' * 2048, 'ids': list(range(10))}
+
+
+def make_backends(directory):
+    """Фабрики кэшей; вызываются заново в каждом процессе."""
+    return {
+        'locmem': lambda: LocMemCache(f'bench-{os.getpid()}', {}),
+        'filebased': lambda: FileBasedCache(
+            os.path.join(directory, 'files'), {}
+        ),
+        'sqlite': lambda: SQLiteCache(
+            os.path.join(directory, 'cache.sqlite3'), {}
+        ),
+    }
+
+
+def timed(operation, keys):
+    started = time.perf_counter()
+    for key in keys:
+        operation(key)
+    return len(keys) / (time.perf_counter() - started)
+
+
+def worker(directory, name, keys, results):
+    """Воркер читает страницы и собирает недостающие, как WSGI-процесс."""
+    cache = make_backends(directory)[name]()
+    hits = 0
+    for key in keys:
+        if cache.get(key) is None:
+            cache.set(key, VALUE)
+        else:
+            hits += 1
+    results.put(hits)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает SQLiteCache с LocMemCache и FileBasedCache: '
+        'скорость операций и долю попаданий при нескольких процессах.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keys', type=int, default=2000)
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        keys = [f'key{i}' for i in range(options['keys'])]
+        directory = tempfile.mkdtemp()
+        try:
+            for name, factory in make_backends(directory).items():
+                cache = factory()
+                cache.clear()
+                set_rate = timed(lambda key: cache.set(key, VALUE), keys)
+                get_rate = timed(cache.get, keys)
+                cache.set('counter', 0)
+                incr_rate = timed(lambda key: cache.incr('counter'), keys)
+                hit_rate = self.shared_hit_rate(
+                    directory, name, keys, options['workers']
+                )
+                self.stdout.write(
+                    f'{name:>10}: set {set_rate:9.0f}/с, '
+                    f'get {get_rate:9.0f}/с, incr {incr_rate:9.0f}/с, '
+                    f'попаданий у {options["workers"]} процессов '
+                    f'{hit_rate:.0%}'
+                )
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def shared_hit_rate(self, directory, name, keys, workers):
+        make_backends(directory)[name]().clear()
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        processes = [
+            context.Process(
+                target=worker, args=(directory, name, keys, results)
+            )
+            for _ in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        hits = sum(results.get() for _ in processes)
+        for process in processes:
+            process.join()
+        return hits / (len(keys) * workers)
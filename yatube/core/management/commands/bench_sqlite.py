@@ -0,0 +1,143 @@
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.signals import set_pragmas
+
+ROWS = 10000
+TEXT = 'x' * 400
+
+
+def connect(path, pragmas):
+    db = sqlite3.connect(path, timeout=5, isolation_level=None)
+    set_pragmas(db, pragmas)
+    return db
+
+
+def prepare(path):
+    db = sqlite3.connect(path, isolation_level=None)
+    db.execute(
+        'CREATE TABLE post (id INTEGER PRIMARY KEY, author INTEGER, '
+        'text TEXT, comments INTEGER NOT NULL DEFAULT 0)'
+    )
+    db.execute('CREATE INDEX post_author ON post (author, id)')
+    db.execute('BEGIN')
+    db.executemany(
+        'INSERT INTO post (author, text) VALUES (?, ?)',
+        ((i % 100, TEXT) for i in range(ROWS)),
+    )
+    db.execute('COMMIT')
+    db.close()
+
+
+def reader(path, pragmas, deadline, results):
+    """Как страница ленты: пост по id и десять последних постов автора."""
+    db = connect(path, pragmas)
+    done = errors = 0
+    while time.time() < deadline:
+        try:
+            db.execute(
+                'SELECT * FROM post WHERE id = ?', (random.randint(1, ROWS),)
+            ).fetchone()
+            db.execute(
+                'SELECT * FROM post WHERE author = ? '
+                'ORDER BY id DESC LIMIT 10',
+                (random.randrange(100),),
+            ).fetchall()
+            done += 1
+        except sqlite3.OperationalError:
+            errors += 1
+    results.put(('read', done, errors))
+
+
+def writer(path, pragmas, deadline, results):
+    """Как новый комментарий: вставка и обновление счетчика в транзакции."""
+    db = connect(path, pragmas)
+    done = errors = 0
+    while time.time() < deadline:
+        try:
+            db.execute('BEGIN')
+            db.execute(
+                'INSERT INTO post (author, text) VALUES (?, ?)',
+                (random.randrange(100), TEXT),
+            )
+            db.execute(
+                'UPDATE post SET comments = comments + 1 WHERE id = ?',
+                (random.randint(1, ROWS),),
+            )
+            db.execute('COMMIT')
+            done += 1
+        except sqlite3.OperationalError:
+            errors += 1
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+    results.put(('write', done, errors))
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность SQLite при параллельных '
+        'читателях и писателях с настройками по умолчанию и с профилем '
+        'CORE_SQLITE_PRAGMAS.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument(
+            '--seconds', type=float, default=3,
+            help='Длительность прогона каждого профиля',
+        )
+
+    def handle(self, *args, **options):
+        profiles = {
+            # Умолчания Django: журнал отката, synchronous=FULL и таймаут
+            # sqlite3.connect в 5 секунд.
+            'default': {},
+            'pragmas': settings.CORE_SQLITE_PRAGMAS,
+        }
+        for name, pragmas in profiles.items():
+            directory = tempfile.mkdtemp()
+            try:
+                path = os.path.join(directory, 'bench.sqlite3')
+                prepare(path)
+                totals = self.run(path, pragmas, options)
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+            seconds = options['seconds']
+            self.stdout.write(
+                f'{name:>10}: чтений {totals["read"][0] / seconds:8.0f}/с, '
+                f'записей {totals["write"][0] / seconds:7.0f}/с, '
+                f'ошибок блокировки {totals["read"][1] + totals["write"][1]}'
+            )
+
+    def run(self, path, pragmas, options):
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        deadline = time.time() + options['seconds']
+        processes = [
+            context.Process(
+                target=target, args=(path, pragmas, deadline, results)
+            )
+            for target, count in (
+                (reader, options['readers']), (writer, options['writers']),
+            )
+            for _ in range(count)
+        ]
+        for process in processes:
+            process.start()
+        totals = {'read': [0, 0], 'write': [0, 0]}
+        for _ in processes:
+            kind, done, errors = results.get()
+            totals[kind][0] += done
+            totals[kind][1] += errors
+        for process in processes:
+            process.join()
+        return totals
@@ -0,0 +1,55 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from core.models import ReplicaHeartbeat
+
+
+class Command(BaseCommand):
+    help = (
+        'Копирует основную базу SQLite в реплики из CORE_READ_REPLICAS: '
+        'локальная замена настоящей репликации.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval',
+            type=float,
+            help='Повторять копирование каждые столько секунд',
+        )
+
+    def handle(self, *args, **options):
+        databases = settings.DATABASES
+        for alias in (DEFAULT_DB_ALIAS, *settings.CORE_READ_REPLICAS):
+            if databases[alias]['ENGINE'] != 'django.db.backends.sqlite3':
+                raise CommandError(f'База {alias} — не SQLite')
+        while True:
+            self.sync()
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def sync(self):
+        # Отметка уезжает в реплики вместе с данными; по ней роутер
+        # считает их отставание.
+        ReplicaHeartbeat.touch()
+        source = sqlite3.connect(settings.DATABASES[DEFAULT_DB_ALIAS]['NAME'])
+        try:
+            for alias in settings.CORE_READ_REPLICAS:
+                started = time.monotonic()
+                target = sqlite3.connect(
+                    settings.DATABASES[alias]['NAME'], timeout=30
+                )
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(
+                    f'{alias}: скопирована за '
+                    f'{time.monotonic() - started:.2f} с'
+                )
+        finally:
+            source.close()
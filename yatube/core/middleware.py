@@ -0,0 +1,119 @@
+import logging
+import os
+import re
+import sys
+from collections import Counter, defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'X-Repeated-Queries'
+MODES = ('log', 'header', 'raise')
+
+# Списки параметров разной длины — тот же запрос: IN (%s, %s) и IN (%s).
+PLACEHOLDERS = re.compile(r'\(\s*%s(?:\s*,\s*%s)*\s*\)')
+DJANGO_ROOT = os.path.dirname(sys.modules['django'].__file__)
+
+
+class RepeatedQueriesError(Exception):
+    pass
+
+
+def normalize(sql):
+    return PLACEHOLDERS.sub('(...)', ' '.join(sql.split()))
+
+
+def query_origin():
+    """Место, откуда пришел запрос: строка шаблона или кода проекта.
+
+    Ближайший узел шаблона важнее кода: ленивую загрузку в цикле
+    шаблона чаще всего и ищут.
+    """
+    frame = sys._getframe(2)
+    code_origin = None
+    while frame is not None:
+        if frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            origin = getattr(node, 'origin', None)
+            token = getattr(node, 'token', None)
+            if origin is not None and token is not None:
+                return f'{origin.template_name}:{token.lineno}'
+        filename = frame.f_code.co_filename
+        if (
+            code_origin is None
+            and not filename.startswith(DJANGO_ROOT)
+            and filename.startswith(settings.BASE_DIR)
+            and filename != __file__
+        ):
+            relpath = os.path.relpath(filename, settings.BASE_DIR)
+            code_origin = f'{relpath}:{frame.f_lineno}'
+        frame = frame.f_back
+    return code_origin or '?'
+
+
+class QueryLog:
+    """Запросы одного HTTP-запроса, сгруппированные по тексту."""
+    def __init__(self):
+        self.origins = defaultdict(Counter)
+
+    def __call__(self, execute, sql, params, many, context):
+        self.origins[normalize(sql)][query_origin()] += 1
+        return execute(sql, params, many, context)
+
+    def repeated(self, threshold):
+        """[(число, запрос, место)] для запросов, повторенных из одного
+        места не меньше threshold раз, начиная с самых частых."""
+        found = []
+        for sql, origins in self.origins.items():
+            origin, count = origins.most_common(1)[0]
+            if count >= threshold:
+                found.append((count, sql, origin))
+        return sorted(found, reverse=True)
+
+
+class RepeatedQueriesMiddleware:
+    """Находит N+1: один и тот же запрос, повторенный из одного места.
+
+    Включается настройкой CORE_REPEATED_QUERIES: 'log' пишет
+    предупреждение в лог, 'header' добавляет к ответу заголовок
+    X-Repeated-Queries, 'raise' бросает RepeatedQueriesError (для тестов).
+    Без настройки middleware исключает себя из цепочки при запуске и
+    ничего не стоит.
+    """
+    def __init__(self, get_response):
+        self.mode = settings.CORE_REPEATED_QUERIES
+        if not self.mode:
+            raise MiddlewareNotUsed
+        if self.mode not in MODES:
+            raise ValueError(
+                f'CORE_REPEATED_QUERIES должна быть одной из {MODES}'
+            )
+        self.get_response = get_response
+
+    def __call__(self, request):
+        log = QueryLog()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(log))
+            response = self.get_response(request)
+        repeated = log.repeated(settings.CORE_REPEATED_QUERIES_THRESHOLD)
+        if repeated:
+            self.report(request, response, repeated)
+        return response
+
+    def report(self, request, response, repeated):
+        if self.mode == 'header':
+            response[HEADER] = '; '.join(
+                f'{origin} x{count}' for count, _, origin in repeated
+            )
+            return
+        message = f'Повторные запросы в {request.path}:\n' + '\n'.join(
+            f'  {origin} x{count}: {sql}' for count, sql, origin in repeated
+        )
+        if self.mode == 'raise':
+            raise RepeatedQueriesError(message)
+        logger.warning(message)
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
 
 
 class CreatedModel(models.Model):
@@ -10,3 +12,46 @@ class CreatedModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+class StoredFile(models.Model):
+    """Число ссылок на файл в HashedStorage."""
+    name = models.CharField('Имя файла', max_length=255, primary_key=True)
+    refs = models.PositiveIntegerField('Ссылок', default=0)
+    updated = models.DateTimeField('Изменен', default=timezone.now)
+
+    class Meta:
+        verbose_name = 'Файл'
+        verbose_name_plural = 'Файлы'
+
+    def __str__(self) -> str:
+        return self.name
+
+    @classmethod
+    def acquire(cls, name):
+        if not cls.objects.filter(name=name).update(
+            refs=F('refs') + 1, updated=timezone.now()
+        ):
+            _, created = cls.objects.get_or_create(
+                name=name, defaults={'refs': 1}
+            )
+            if not created:
+                cls.acquire(name)
+
+    @classmethod
+    def release(cls, name):
+        cls.objects.filter(name=name, refs__gt=0).update(
+            refs=F('refs') - 1, updated=timezone.now()
+        )
+
+
+class ReplicaHeartbeat(models.Model):
+    """Отметка времени, которую основная база передает репликам.
+
+    Разница между текущим временем и отметкой в реплике — ее отставание.
+    """
+    beat = models.DateTimeField('Отметка')
+
+    @classmethod
+    def touch(cls):
+        cls.objects.update_or_create(pk=1, defaults={'beat': timezone.now()})
@@ -0,0 +1,143 @@
+import functools
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils import timezone
+
+PIN_COOKIE = 'primary_until'
+
+_state = threading.local()
+_health = {}
+_health_lock = threading.Lock()
+
+
+def replica_lag(alias):
+    """Отставание реплики в секундах или None, если его не узнать."""
+    from .models import ReplicaHeartbeat
+
+    try:
+        beat = (
+            ReplicaHeartbeat.objects.using(alias)
+            .filter(pk=1)
+            .values_list('beat', flat=True)
+            .first()
+        )
+    except DatabaseError:
+        return None
+    if beat is None:
+        return None
+    return (timezone.now() - beat).total_seconds()
+
+
+def is_healthy(alias):
+    """Не отстает ли реплика больше CORE_REPLICA_MAX_LAG.
+
+    Отставание проверяется не чаще раза в CORE_REPLICA_CHECK_INTERVAL
+    секунд на процесс.
+    """
+    now = time.monotonic()
+    with _health_lock:
+        checked = _health.get(alias)
+        if checked is not None and now - checked[0] < (
+            settings.CORE_REPLICA_CHECK_INTERVAL
+        ):
+            return checked[1]
+        # Пока идет проверка, остальные потоки видят прежний результат.
+        _health[alias] = (now, checked[1] if checked else False)
+    lag = replica_lag(alias)
+    healthy = lag is not None and lag <= settings.CORE_REPLICA_MAX_LAG
+    with _health_lock:
+        _health[alias] = (now, healthy)
+    return healthy
+
+
+def replica_reads(view):
+    """Разрешает представлению читать из реплик CORE_READ_REPLICAS."""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        _state.replica = True
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _state.replica = False
+    return wrapper
+
+
+def note_write():
+    """Отмечает запись в текущем запросе, сделанную в обход роутера."""
+    _state.wrote = True
+
+
+class ReplicaRouter:
+    """Чтения моделей CORE_REPLICA_APPS в представлениях с replica_reads —
+    в реплики, остальное — в основную базу.
+
+    Сессии, пользователи и метаданные миниатюр всегда читаются из
+    основной базы: их свежесть нужна каждому запросу. Пользователь,
+    который недавно писал, закреплен за основной базой (см.
+    ReplicaPinMiddleware), а реплика, отставшая больше
+    CORE_REPLICA_MAX_LAG, не используется.
+    """
+    def db_for_read(self, model, **hints):
+        if (
+            model._meta.app_label not in settings.CORE_REPLICA_APPS
+            or not getattr(_state, 'replica', False)
+            or getattr(_state, 'pinned', False)
+            or getattr(_state, 'wrote', False)
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        replicas = [
+            alias for alias in settings.CORE_READ_REPLICAS
+            if is_healthy(alias)
+        ]
+        return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        note_write()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Реплики — копии основной базы, их схема приходит вместе с ней.
+        return db not in settings.CORE_READ_REPLICAS
+
+
+class ReplicaPinMiddleware:
+    """Закрепляет за основной базой пользователя, который что-то записал.
+
+    Срок закрепления — CORE_REPLICA_PIN_SECONDS — хранится в cookie,
+    чтобы следующий запрос, например редирект после формы, увидел
+    только что записанное.
+    """
+    def __init__(self, get_response):
+        if not settings.CORE_READ_REPLICAS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            pinned_until = float(request.COOKIES.get(PIN_COOKIE, 0))
+        except ValueError:
+            pinned_until = 0
+        _state.pinned = time.time() < pinned_until
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+            if _state.wrote:
+                response.set_cookie(
+                    PIN_COOKIE,
+                    str(time.time() + settings.CORE_REPLICA_PIN_SECONDS),
+                    max_age=settings.CORE_REPLICA_PIN_SECONDS,
+                    httponly=True,
+                    samesite='Lax',
+                )
+            return response
+        finally:
+            _state.pinned = _state.wrote = False
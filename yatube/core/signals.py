@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def set_pragmas(cursor, pragmas):
+    """Выполняет PRAGMA name = value для каждой пары из pragmas."""
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created)
+def apply_sqlite_profile(sender, connection, **kwargs):
+    """Настраивает каждое новое соединение с SQLite по CORE_SQLITE_PRAGMAS.
+
+    Большинство PRAGMA действуют только на текущее соединение, поэтому
+    их нужно повторять при каждом подключении; journal_mode=WAL
+    сохраняется в самом файле базы.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        set_pragmas(cursor, settings.CORE_SQLITE_PRAGMAS)
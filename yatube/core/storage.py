@@ -0,0 +1,70 @@
+import hashlib
+import os
+import posixpath
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+from .models import StoredFile
+
+HASHED_NAME = re.compile(r'(^|/)([0-9a-f]{2})/([0-9a-f]{2})/\2\3[0-9a-f]{60}')
+
+
+@deconstructible
+class HashedStorage(FileSystemStorage):
+    """Хранилище, в котором имя файла — хэш его содержимого.
+
+    Файл из каталога upload_to попадает в upload_to/ab/cd/abcd….ext, где
+    abcd… — SHA-256 содержимого: так в одном каталоге не скапливаются
+    миллионы файлов. Одинаковые загрузки хранятся в одном экземпляре,
+    а число ссылок на файл ведет модель StoredFile: save() добавляет
+    ссылку, release() снимает. Файлы без ссылок удаляет сборщик мусора.
+    """
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        digest = digest.hexdigest()
+        directory, filename = posixpath.split(name.replace('\\', '/'))
+        extension = os.path.splitext(filename)[1].lower()
+        return posixpath.join(
+            directory, digest[:2], digest[2:4], digest + extension
+        )
+
+    @staticmethod
+    def is_hashed(name):
+        return HASHED_NAME.search(name) is not None
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        # Ссылка появляется до проверки файла: сборщик мусора, который
+        # прячет файл и перепроверяет ссылки, либо увидит ее и вернет
+        # файл, либо успеет убрать его до проверки, и файл запишется
+        # заново.
+        StoredFile.acquire(name)
+        try:
+            if not self.exists(name):
+                saved = self._save(name, content)
+                if saved != name:
+                    # Такой же файл одновременно записал другой процесс,
+                    # и FileSystemStorage сохранил копию под другим
+                    # именем.
+                    self.delete(saved)
+        except BaseException:
+            StoredFile.release(name)
+            raise
+        return name
+
+    def release(self, name):
+        """Снимает ссылку на файл, сохраненный через save()."""
+        StoredFile.release(name)
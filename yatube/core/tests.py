@@ -1,10 +1,430 @@
-from django.test import TestCase
+import multiprocessing
+import shutil
+import sqlite3
+import tempfile
+import os
+import time
+
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.cache import cache, caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import (
+    Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
 from http import HTTPStatus
 
+from django.core.files.base import ContentFile
+
+from .cache.counters import Counters
+from .cache.sqlite import SQLiteCache
+from .checks import check_replica_pin
+from .cache.tiered import TieredCache
+from .middleware import RepeatedQueriesError, RepeatedQueriesMiddleware
+from .replicas import (
+    PIN_COOKIE, ReplicaPinMiddleware, ReplicaRouter, replica_lag,
+    replica_reads,
+)
+from .models import ReplicaHeartbeat, StoredFile
+from .storage import HashedStorage
+from posts.models import Post
+
+User = get_user_model()
+
 
 class ViewTestClass(TestCase):
     def test_error_page(self):
         response = self.client.get('/nonexist-page/')
         self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+def increment_many(path, times):
+    cache = SQLiteCache(path, {})
+    for _ in range(times):
+        cache.incr('counter')
+
+
+class SQLiteCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = SQLiteCache(self.path, {'OPTIONS': {'MAX_SIZE': 4096}})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_basic_operations(self):
+        """get/set/add/incr/delete ведут себя как у кэшей Django."""
+        self.cache.set('key', {'value': [1, 2]})
+        self.assertEqual(self.cache.get('key'), {'value': [1, 2]})
+        self.assertFalse(self.cache.add('key', 'other'))
+        self.assertTrue(self.cache.add('new', 1))
+        self.assertEqual(self.cache.incr('new', 5), 6)
+        self.assertEqual(self.cache.get_many(['key', 'new', 'none']), {
+            'key': {'value': [1, 2]}, 'new': 6,
+        })
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+        with self.assertRaises(ValueError):
+            self.cache.incr('key')
+
+    def test_expiration(self):
+        """Просроченные записи не возвращаются и не мешают add."""
+        self.cache.set('key', 'value', 0.05)
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get('key'))
+        self.assertTrue(self.cache.add('key', 'value'))
+
+    def test_overwrite_keeps_total_size(self):
+        """Перезапись ключа не увеличивает учтенный объем кэша."""
+        for _ in range(100):
+            self.cache.set('key', 'x' * 500)
+        total, stored = self.cache._db.execute(
+            'SELECT total, (SELECT sum(size) FROM cache) FROM cache_size'
+        ).fetchone()
+        self.assertEqual(total, stored)
+        self.assertEqual(self.cache.get('key'), 'x' * 500)
+
+    def test_lru_eviction(self):
+        """При превышении MAX_SIZE вытесняются давно не читанные записи."""
+        self.cache.set('hot', 'x' * 1000)
+        for i in range(10):
+            self.cache.set(f'key{i}', 'x' * 1000)
+            time.sleep(0.01)
+            self.cache._touch_interval = 0
+            self.cache.get('hot')
+        self.assertIsNotNone(self.cache.get('hot'))
+        self.assertIsNone(self.cache.get('key0'))
+
+    def test_incr_is_atomic_across_processes(self):
+        """Процессы, работающие с одним файлом, не теряют инкременты."""
+        self.cache.set('counter', 0)
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(target=increment_many, args=(self.path, 50))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+
+
+class TieredCacheTest(SimpleTestCase):
+    def setUp(self):
+        options = {'OPTIONS': {'STALENESS': 0.05, 'MAX_ENTRIES': 3}}
+        self.worker1 = TieredCache('shared', options)
+        self.worker2 = TieredCache('shared', options)
+        self.worker1.clear()
+
+    def test_reads_are_served_from_memory(self):
+        """Повторное чтение не обращается к общему кэшу."""
+        self.worker1.set('key', 'value')
+        with mock.patch.object(caches['shared'], 'get_many') as get_many:
+            self.assertEqual(self.worker1.get('key'), 'value')
+        get_many.assert_not_called()
+
+    def test_mutable_values_are_copied(self):
+        """Изменение полученного объекта не портит копию в памяти."""
+        self.worker1.set('key', {'a': 1})
+        self.worker1.get('key')['a'] = 2
+        self.assertEqual(self.worker1.get('key'), {'a': 1})
+
+    def test_invalidation_reaches_other_workers(self):
+        """Запись в одном процессе видна другому не позже STALENESS."""
+        self.worker1.set('key', 'old')
+        self.assertEqual(self.worker2.get('key'), 'old')
+        self.worker1.set('key', 'new')
+        time.sleep(0.1)
+        self.assertEqual(self.worker2.get('key'), 'new')
+        self.worker1.delete('key')
+        time.sleep(0.1)
+        self.assertIsNone(self.worker2.get('key'))
+
+    def test_lru_bound(self):
+        """Первый уровень не хранит больше MAX_ENTRIES записей."""
+        for i in range(5):
+            self.worker1.set(f'key{i}', i)
+        self.assertEqual(len(self.worker1._entries), 3)
+        self.assertEqual(self.worker1.get('key0'), 0)
+
+
+@override_settings(CORE_COUNTERS_FLUSH_INTERVAL=60)
+class CountersTest(SimpleTestCase):
+    def setUp(self):
+        caches['shared'].clear()
+        self.counters = Counters('test:counter:{}', ('hit', 'miss'))
+
+    def test_increments_are_batched(self):
+        """Приращения копятся в процессе и не трогают штампы корзин."""
+        shared = caches['shared']
+        with mock.patch.object(shared, 'incr') as incr, \
+                mock.patch.object(shared, 'add') as add:
+            for _ in range(100):
+                self.counters.add('hit')
+        incr.assert_not_called()
+        add.assert_not_called()
+        self.assertEqual(self.counters.get(), {'hit': 100, 'miss': 0})
+        self.counters.add('hit', 5)
+        self.assertEqual(self.counters.get(), {'hit': 105, 'miss': 0})
+        self.assertFalse(any(
+            key.startswith(':1:tiered:stamp') for key in shared._cache
+        ))
+        self.counters.reset()
+        self.assertEqual(self.counters.get(), {'hit': 0, 'miss': 0})
+
+    @override_settings(CORE_COUNTERS_FLUSH_INTERVAL=0.05)
+    def test_pending_increments_flushed_by_timer(self):
+        """Накопленное уходит в общий кэш без новых приращений и get()."""
+        self.counters.add('miss', 3)
+        time.sleep(0.2)
+        self.assertEqual(caches['shared'].get('test:counter:miss'), 3)
+
+
+class HashedStorageTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.storage = HashedStorage(location=self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_identical_uploads_stored_once(self):
+        """Одинаковое содержимое хранится одним файлом с двумя ссылками."""
+        first = self.storage.save('posts/a.gif', ContentFile(b'picture'))
+        second = self.storage.save('posts/b.GIF', ContentFile(b'picture'))
+        self.assertEqual(first, second)
+        self.assertTrue(HashedStorage.is_hashed(first))
+        digest = first.split('/')[-1]
+        self.assertEqual(first, f'posts/{digest[:2]}/{digest[2:4]}/{digest}')
+        self.assertTrue(digest.endswith('.gif'))
+        self.assertEqual(StoredFile.objects.get(name=first).refs, 2)
+        other = self.storage.save('posts/c.gif', ContentFile(b'another'))
+        self.assertNotEqual(other, first)
+        self.assertEqual(
+            sorted(os.listdir(os.path.dirname(self.storage.path(first)))),
+            [digest],
+        )
+
+    def test_release_decrements_refs(self):
+        """release() снимает ссылку, но не уходит ниже нуля."""
+        name = self.storage.save('posts/a.gif', ContentFile(b'picture'))
+        self.storage.release(name)
+        self.storage.release(name)
+        self.assertEqual(StoredFile.objects.get(name=name).refs, 0)
+        self.assertTrue(self.storage.exists(name))
+
+
+def lazy_loop_view(request):
+    for name in ('a', 'b', 'c'):
+        StoredFile.objects.filter(name=name).exists()
+    for names in (['a', 'b'], ['c']):
+        StoredFile.objects.filter(name__in=names).exists()
+    return HttpResponse()
+
+
+@override_settings(CORE_REPEATED_QUERIES_THRESHOLD=2)
+class RepeatedQueriesMiddlewareTest(TestCase):
+    def get(self, view=lazy_loop_view):
+        return RepeatedQueriesMiddleware(view)(RequestFactory().get('/'))
+
+    def test_disabled(self):
+        """Без настройки middleware убирает себя из цепочки."""
+        with self.assertRaises(MiddlewareNotUsed):
+            self.get()
+
+    @override_settings(CORE_REPEATED_QUERIES='header')
+    def test_header_names_origin(self):
+        """Повторы группируются по запросу без учета длины списков
+        параметров, в заголовке — строка, откуда они пришли."""
+        response = self.get()
+        line = lazy_loop_view.__code__.co_firstlineno + 2
+        self.assertEqual(
+            response['X-Repeated-Queries'],
+            f'core/tests.py:{line} x3; core/tests.py:{line + 2} x2',
+        )
+
+    @override_settings(CORE_REPEATED_QUERIES='raise')
+    def test_raise(self):
+        with self.assertRaises(RepeatedQueriesError):
+            self.get()
+        self.get(lambda request: HttpResponse())
+
+
+class SQLiteProfileTest(TestCase):
+    def test_new_connections_get_pragmas(self):
+        """Профиль PRAGMA применяется к каждому новому соединению."""
+        with connection.cursor() as cursor:
+            values = {}
+            for name in ('synchronous', 'busy_timeout', 'temp_store'):
+                cursor.execute(f'PRAGMA {name}')
+                values[name] = cursor.fetchone()[0]
+        # synchronous=NORMAL — 1, temp_store=MEMORY — 2.
+        self.assertEqual(
+            values, {'synchronous': 1, 'busy_timeout': 5000, 'temp_store': 2}
+        )
+
+
+@override_settings(CORE_READ_REPLICAS=('replica',), CORE_REPLICA_MAX_LAG=30)
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch('core.replicas.replica_lag', return_value=1)
+        self.replica_lag = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict('core.replicas._health', clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = ReplicaRouter()
+
+    def read_view(self, request):
+        """Отдает в response.db базу, которую роутер выбрал для чтения."""
+        response = HttpResponse()
+        response.db = self.router.db_for_read(Post)
+        return response
+
+    def request(self, view, cookies=None):
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies or {})
+        return ReplicaPinMiddleware(view)(request)
+
+    def test_reads_go_to_replica_only_in_marked_views(self):
+        """Из реплики читают только представления с replica_reads."""
+        self.assertEqual(self.request(self.read_view).db, 'default')
+        self.assertEqual(
+            self.request(replica_reads(self.read_view)).db, 'replica'
+        )
+
+    def test_lagging_replica_skipped(self):
+        """Отставшая реплика не используется."""
+        self.replica_lag.return_value = 60
+        response = self.request(replica_reads(self.read_view))
+        self.assertEqual(response.db, 'default')
+
+    def test_only_replica_apps_read_from_replica(self):
+        """Сессии, пользователи и файлы читаются из основной базы."""
+        @replica_reads
+        def view(request):
+            response = HttpResponse()
+            response.dbs = [
+                self.router.db_for_read(model)
+                for model in (Session, User, StoredFile)
+            ]
+            return response
+
+        self.assertEqual(self.request(view).dbs, ['default'] * 3)
+
+    def test_writer_pinned_to_primary(self):
+        """После записи пользователь читает из основной базы, пока
+        не истечет срок в cookie."""
+        view = replica_reads(self.read_view)
+
+        @replica_reads
+        def write_view(request):
+            self.router.db_for_write(Post)
+            return self.read_view(request)
+
+        response = self.request(write_view)
+        self.assertEqual(response.db, 'default')
+        cookie = response.cookies[PIN_COOKIE].value
+        response = self.request(view, {PIN_COOKIE: cookie})
+        self.assertEqual(response.db, 'default')
+        response = self.request(view, {PIN_COOKIE: '0'})
+        self.assertEqual(response.db, 'replica')
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+
+@override_settings(CORE_READ_REPLICAS=('replica',))
+class ReplicaFeedTest(TransactionTestCase):
+    """Лента через реплику, в которую еще не пришли свежие записи."""
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='ТестАвтор')
+        self.post = Post.objects.create(text='Старый пост', author=self.user)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'replica.sqlite3')
+        # Снимок основной базы, как после sync_replicas.
+        connection.ensure_connection()
+        target = sqlite3.connect(path)
+        connection.connection.backup(target)
+        target.close()
+        patcher = mock.patch.dict(connections.databases, {'replica': {
+            'ENGINE': 'django.db.backends.sqlite3', 'NAME': path,
+        }})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.drop_replica_connection)
+        patcher = mock.patch('core.replicas.replica_lag', return_value=1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.dict('core.replicas._health', clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def drop_replica_connection():
+        if hasattr(connections._connections, 'replica'):
+            connections['replica'].close()
+            del connections['replica']
+
+    def test_login_survives_replica_reads(self):
+        """Сессия и пользователь читаются из основной базы, даже если
+        реплика о них еще не знает."""
+        client = Client()
+        client.force_login(self.user)
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        with CaptureQueriesContext(connections['replica']) as queries:
+            response = client.get(url)
+        self.assertTrue(queries.captured_queries)
+        self.assertTrue(response.context['user'].is_authenticated)
+        self.assertContains(response, 'Старый пост')
+        response = client.get(reverse('posts:post_create'))
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_cached_feed_not_filled_from_replica(self):
+        """Правка и новый пост видны в ленте, даже если реплика о них
+        еще не знает: в общий кэш попадает только основная база."""
+        client = Client()
+        self.assertContains(client.get(reverse('posts:index')), 'Старый')
+        self.post.text = 'Исправленный пост'
+        self.post.save()
+        Post.objects.create(text='Новый пост', author=self.user)
+        for _ in range(2):
+            response = client.get(reverse('posts:index'))
+            self.assertContains(response, 'Исправленный пост')
+            self.assertContains(response, 'Новый пост')
+            self.assertNotContains(response, 'Старый пост')
+
+
+class ReplicaPinCheckTest(SimpleTestCase):
+    @override_settings(
+        CORE_READ_REPLICAS=('replica',), CORE_REPLICA_MAX_LAG=30,
+        CORE_REPLICA_CHECK_INTERVAL=5,
+    )
+    def test_pin_shorter_than_lag(self):
+        """Закрепление короче допустимого отставания — ошибка."""
+        with self.settings(CORE_REPLICA_PIN_SECONDS=10):
+            errors = check_replica_pin(None)
+        self.assertEqual([error.id for error in errors], ['core.E001'])
+        with self.settings(CORE_REPLICA_PIN_SECONDS=35):
+            self.assertEqual(check_replica_pin(None), [])
+
+
+class ReplicaLagTest(TestCase):
+    def test_lag_from_heartbeat(self):
+        """Отставание считается по отметке, пришедшей из основной базы."""
+        self.assertIsNone(replica_lag('default'))
+        ReplicaHeartbeat.touch()
+        ReplicaHeartbeat.touch()
+        self.assertEqual(ReplicaHeartbeat.objects.count(), 1)
+        self.assertLess(replica_lag('default'), 5)
@@ -1,6 +1,9 @@
 from django.contrib import admin
+from django.db import connections
+from django.db.models.expressions import RawSQL
 
 from .models import Post, Group
+from .search import match_expression, matching_ids
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -16,6 +19,18 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('created',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по индексу FTS5 вместо LIKE '%…%' по всей таблице.
+        if (
+            not match_expression(search_term)
+            or connections[queryset.db].vendor != 'sqlite'
+        ):
+            return super().get_search_results(
+                request, queryset, search_term
+            )
+        ids = RawSQL(*matching_ids(search_term))
+        return queryset.filter(pk__in=ids), False
+
 
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group)
@@ -0,0 +1,226 @@
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.paginator import Page
+from django.db import DEFAULT_DB_ALIAS
+
+from core.cache.counters import Counters
+
+from .funcs import (
+    PAGES, CachedPaginator, CursorPage, decorate_page, get_page_object,
+    page_cursors, page_query,
+)
+from .models import Post
+
+GENERATION_KEY = 'posts:generation:{}'
+COUNT_KEY = 'posts:count:{}.{}'
+POST_KEY = 'posts:post:{}'
+STATS_KEY = 'posts:cache_stats:{}'
+STATS_EVENTS = ('hit', 'stale', 'miss', 'regeneration', 'lock_wait')
+
+cache_stats = Counters(STATS_KEY, STATS_EVENTS)
+
+logger = logging.getLogger(__name__)
+
+
+def _new_generation():
+    # Поколение, созданное заново после вытеснения из кэша, всегда
+    # больше любого из прежних, поэтому старые списки не оживут.
+    return int(time.time() * 1000)
+
+
+def shared_cache():
+    """Кэш POSTS_SHARED_CACHE для поколений и блокировок.
+
+    Их не держат в памяти процесса, а каждая запись в двухуровневый кэш
+    повышает штамп корзины и сбрасывает соседние записи в памяти всех
+    процессов.
+    """
+    return caches[settings.POSTS_SHARED_CACHE]
+
+
+def get_generations(scopes):
+    """Текущие поколения областей кэша за один запрос к кэшу."""
+    shared = shared_cache()
+    keys = [GENERATION_KEY.format(scope) for scope in scopes]
+    generations = shared.get_many(keys)
+    for key in keys:
+        if key not in generations:
+            shared.add(key, _new_generation(), None)
+            generations[key] = shared.get(key)
+    return [generations[key] for key in keys]
+
+
+def bump_generations(scopes):
+    """Сбрасывает закэшированные ленты перечисленных областей."""
+    shared = shared_cache()
+    for scope in set(scopes):
+        key = GENERATION_KEY.format(scope)
+        try:
+            shared.incr(key)
+        except ValueError:
+            shared.add(key, _new_generation(), None)
+
+
+def post_scopes(post):
+    """Области кэша, в лентах которых виден пост."""
+    scopes = ['index', f'author:{post.author.username}']
+    if post.group_id:
+        scopes.append(f'group:{post.group.slug}')
+    return scopes
+
+
+def forget_posts(post_ids):
+    """Сбрасывает закэшированные объекты постов."""
+    cache.delete_many([POST_KEY.format(pk) for pk in post_ids])
+
+
+def record(event):
+    """Увеличивает счетчик события кэша лент."""
+    cache_stats.add(event)
+
+
+def get_cache_stats():
+    return cache_stats.get()
+
+
+def _wait_for(key):
+    """Ждет значение, которое собирает владелец блокировки."""
+    record('lock_wait')
+    deadline = time.monotonic() + settings.POSTS_PAGE_CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    logger.warning('Не дождались значения %s', key)
+    return None
+
+
+def cached_value(key, build):
+    """Значение из кэша с мягким и жестким TTL.
+
+    После мягкого TTL значение пересобирает ровно один запрос, взявший
+    блокировку в кэше; остальные в это время получают устаревшую копию.
+    Если копии нет вовсе, они недолго ждут, пока значение соберет
+    владелец блокировки.
+    """
+    entry = cache.get(key)
+    if entry is not None and time.time() < entry[1]:
+        record('hit')
+        return entry[0]
+    lock_key = key + ':lock'
+    locked = shared_cache().add(
+        lock_key, 1, settings.POSTS_PAGE_CACHE_LOCK
+    )
+    if not locked:
+        if entry is not None:
+            record('stale')
+            return entry[0]
+        entry = _wait_for(key)
+        if entry is not None:
+            return entry[0]
+    elif entry is None:
+        record('miss')
+    started = time.monotonic()
+    try:
+        value = build()
+        cache.set(
+            key,
+            (value, time.time() + settings.POSTS_PAGE_CACHE_SOFT_TIMEOUT),
+            settings.POSTS_PAGE_CACHE_TIMEOUT,
+        )
+    finally:
+        if locked:
+            shared_cache().delete(lock_key)
+    record('regeneration')
+    logger.debug(
+        'Значение %s пересобрано за %.3f с', key, time.monotonic() - started
+    )
+    return value
+
+
+def get_posts(post_ids):
+    """Посты по списку id в том же порядке.
+
+    Берутся одним get_many из кэша объектов; недостающие загружаются
+    одним in_bulk и кладутся в кэш. Загружаются они из основной базы:
+    отставшая реплика положила бы в кэш старую версию поста на весь
+    POSTS_OBJECT_CACHE_TIMEOUT.
+    """
+    keys = {pk: POST_KEY.format(pk) for pk in post_ids}
+    found = cache.get_many(keys.values())
+    posts = {pk: found[key] for pk, key in keys.items() if key in found}
+    missing = [pk for pk in post_ids if pk not in posts]
+    if missing:
+        loaded = (
+            Post.objects.using(DEFAULT_DB_ALIAS).for_feed().in_bulk(missing)
+        )
+        cache.set_many(
+            {POST_KEY.format(pk): post for pk, post in loaded.items()},
+            settings.POSTS_OBJECT_CACHE_TIMEOUT,
+        )
+        posts.update(loaded)
+    return [posts[pk] for pk in post_ids if pk in posts]
+
+
+def feed_count(scope, generation, post_list):
+    """Число постов ленты, закэшированное до смены поколения области.
+
+    Оно меняется вместе со списками страниц, поэтому и сбрасывается
+    вместе с ними, а не по POSTS_PAGINATOR_COUNT_TIMEOUT.
+    """
+    key = COUNT_KEY.format(scope, generation)
+    count = cache.get(key)
+    if count is None:
+        count = post_list.count()
+        cache.set(key, count, settings.POSTS_PAGE_CACHE_TIMEOUT)
+    return count
+
+
+def get_feed_page(request, scope, post_list, count=None):
+    """Страница ленты, закэшированная как список id постов.
+
+    Список зависит от поколения области scope и меняется только при
+    появлении или исчезновении постов в ленте; правка поста сбрасывает
+    лишь его собственную запись в кэше объектов. Список собирается
+    по основной базе, как и объекты в get_posts. Ключ зависит только
+    от параметров страницы (page_query), а не от всей строки запроса.
+    """
+    (generation,) = get_generations([scope])
+    feed_list = (
+        post_list.using(DEFAULT_DB_ALIAS)
+        .select_related(None)
+        .only('pk', 'created')
+    )
+    if count is None and not page_cursors(request):
+        count = feed_count(scope, generation, feed_list)
+    query = page_query(request, feed_list, count=count)
+    key = 'posts:feed:' + hashlib.md5(
+        f'{scope}.{generation}?{query}'.encode()
+    ).hexdigest()
+
+    def build():
+        page_obj = get_page_object(request, feed_list, count=count)
+        ids = [post.pk for post in page_obj]
+        if getattr(page_obj, 'is_cursor', False):
+            return {
+                'ids': ids,
+                'has_next': page_obj.has_next(),
+                'has_previous': page_obj.has_previous(),
+            }
+        return {
+            'ids': ids,
+            'number': page_obj.number,
+            'count': page_obj.paginator.count,
+        }
+
+    entry = cached_value(key, build)
+    posts = get_posts(entry['ids'])
+    if 'number' not in entry:
+        return CursorPage(posts, entry['has_next'], entry['has_previous'])
+    paginator = CachedPaginator(post_list, PAGES, count=entry['count'])
+    return decorate_page(Page(posts, entry['number'], paginator))
@@ -1,11 +1,261 @@
+import base64
+import binascii
+import hashlib
+from collections.abc import Sequence
+
+from django.conf import settings
+from django.core.cache import cache
 from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
 
 
 PAGES = 10
+COMMENTS = 20
+REPLIES = 3
+REPLIES_PAGE = 50
+ELLIPSIS = '…'
+# Поля ключа (created, id), по которому сортируются и листаются ленты.
+KEY = ('created', 'pk')
+
+
+def encode_cursor(post):
+    """Кодирует ключ (created, id) поста в непрозрачный токен для URL."""
+    raw = f'{post.created.isoformat()}|{post.pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Возвращает пару (created, id) или None, если токен испорчен."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        created, pk = raw.split('|')
+        created = parse_datetime(created)
+        pk = int(pk)
+    except (ValueError, UnicodeError, binascii.Error):
+        return None
+    if created is None:
+        return None
+    return created, pk
+
+
+class CursorPage(Sequence):
+    """Страница ленты, выбранная по ключу (created, id).
+
+    В отличие от Page не знает ни своего номера, ни общего числа
+    страниц: для неё не нужны ни COUNT(*), ни OFFSET.
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def next_cursor(self):
+        if self.has_next():
+            return encode_cursor(self.object_list[-1])
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous():
+            return encode_cursor(self.object_list[0])
+        return None
+
+
+class CachedPaginator(Paginator):
+    """Paginator, который не считает COUNT(*) на каждый запрос.
+
+    Число объектов берется из count, если оно известно заранее, или из
+    кэша на POSTS_PAGINATOR_COUNT_TIMEOUT секунд. Ссылки на страницы
+    выводятся окном вокруг текущей, поэтому размер HTML не растет
+    вместе с числом постов.
+    """
+    ELLIPSIS = ELLIPSIS
 
+    def __init__(self, object_list, per_page, count=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self._count = count
 
-def get_page_object(request, post_list):
-    paginator = Paginator(post_list, PAGES)
+    @property
+    def count(self):
+        if self._count is None:
+            self._count = self._cached_count()
+        return self._count
+
+    def _cached_count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is None:
+            return len(self.object_list)
+        key = 'posts:count:' + hashlib.md5(str(query).encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = self.object_list.count()
+            cache.set(key, count, settings.POSTS_PAGINATOR_COUNT_TIMEOUT)
+        return count
+
+    def page(self, number):
+        # Закэшированное число может отставать: срез страницы от него
+        # не зависит, иначе новые посты обрезались бы до старого count.
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(
+            self.object_list[bottom:bottom + self.per_page], number, self
+        )
+
+    def get_elided_page_range(self, number, on_each_side=2, on_ends=1):
+        """Номера страниц: края и соседи текущей, пропуски — ELLIPSIS."""
+        num_pages = self.num_pages
+        if num_pages <= (on_each_side + on_ends) * 2 + 1:
+            return list(self.page_range)
+        window = range(
+            max(number - on_each_side, 1),
+            min(number + on_each_side, num_pages) + 1,
+        )
+        pages = []
+        for page in range(1, on_ends + 1):
+            if page < window.start:
+                pages.append(page)
+        if on_ends + 1 < window.start:
+            pages.append(ELLIPSIS)
+        pages.extend(window)
+        if window.stop <= num_pages - on_ends:
+            pages.append(ELLIPSIS)
+        for page in range(num_pages - on_ends + 1, num_pages + 1):
+            if page >= window.stop:
+                pages.append(page)
+        return pages
+
+
+def get_cursor_page(
+    post_list, after=None, before=None, per_page=PAGES, key=KEY,
+):
+    """Отбирает страницу постов после (или до) ключа (created, id).
+
+    key — поля, по которым хранится этот ключ; у ленты подписок это
+    копии в записях Timeline, чтобы сортировать по ее индексу.
+    """
+    created_field, pk_field = key
+    if before is not None:
+        created, pk = before
+        posts = list(
+            post_list.filter(
+                Q(**{f'{created_field}__gt': created})
+                | Q(**{created_field: created, f'{pk_field}__gt': pk})
+            ).order_by(*key)[:per_page + 1]
+        )
+        has_previous = len(posts) > per_page
+        posts = posts[:per_page][::-1]
+        return CursorPage(posts, has_next=True, has_previous=has_previous)
+    post_list = post_list.order_by(*(f'-{field}' for field in key))
+    if after is not None:
+        created, pk = after
+        post_list = post_list.filter(
+            Q(**{f'{created_field}__lt': created})
+            | Q(**{created_field: created, f'{pk_field}__lt': pk})
+        )
+    posts = list(post_list[:per_page + 1])
+    return CursorPage(
+        posts[:per_page],
+        has_next=len(posts) > per_page,
+        has_previous=after is not None,
+    )
+
+
+def get_comment_page(comment_list, after=None, per_page=COMMENTS):
+    """Отбирает комментарии от старых к новым после ключа (created, id)."""
+    comment_list = comment_list.order_by('created', 'pk')
+    if after is not None:
+        created, pk = after
+        comment_list = comment_list.filter(
+            Q(created__gt=created) | Q(created=created, pk__gt=pk)
+        )
+    comments = list(comment_list[:per_page + 1])
+    return CursorPage(
+        comments[:per_page],
+        has_next=len(comments) > per_page,
+        has_previous=after is not None,
+    )
+
+
+def page_cursors(request):
+    """Исправные курсоры ?after= и ?before= запроса."""
+    cursors = {
+        name: decode_cursor(request.GET.get(name, ''))
+        for name in ('after', 'before')
+    }
+    return {
+        name: cursor for name, cursor in cursors.items() if cursor is not None
+    }
+
+
+def get_page_object(request, post_list, count=None, key=KEY):
+    """Постраничная разбивка ленты.
+
+    По умолчанию страницы нумерованные (?page=), что удобно для
+    небольших выборок. Если в запросе передан курсор ?after= или
+    ?before=, страница отбирается по ключу и время ответа не зависит
+    от глубины листания.
+
+    Если число постов уже известно (count), COUNT(*) не выполняется,
+    иначе его результат кэшируется CachedPaginator. Запрос постов
+    сортируется по полям key, как в get_cursor_page.
+    """
+    cursors = page_cursors(request)
+    if cursors:
+        return get_cursor_page(post_list, key=key, **cursors)
+    post_list = post_list.order_by(*(f'-{field}' for field in key))
+    paginator = CachedPaginator(post_list, PAGES, count=count)
     page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    return decorate_page(paginator.get_page(page_number))
+
+
+def page_query(request, post_list, count=None, key=KEY):
+    """Параметры страницы get_page_object в каноническом виде.
+
+    Курсоры раскодируются, номер страницы приводится к существующему,
+    остальные параметры запроса отбрасываются: по этой строке кэшируют
+    страницы лент, и ?page=abc, ?page=9999 или метки ?utm= не должны
+    плодить новые записи.
+    """
+    cursors = page_cursors(request)
+    if cursors:
+        return '&'.join(
+            f'{name}={created.isoformat()}|{pk}'
+            for name, (created, pk) in cursors.items()
+        )
+    post_list = post_list.order_by(*(f'-{field}' for field in key))
+    paginator = CachedPaginator(post_list, PAGES, count=count)
+    return f'page={paginator.get_page(request.GET.get("page")).number}'
+
+
+def decorate_page(page_obj):
+    """Дополняет нумерованную страницу окном номеров и курсором."""
+    page_obj.elided_page_range = page_obj.paginator.get_elided_page_range(
+        page_obj.number
+    )
+    if page_obj.has_next() and len(page_obj):
+        # Дальше листаем по курсору, а не по номеру страницы.
+        page_obj.next_cursor = encode_cursor(page_obj[len(page_obj) - 1])
     return page_obj
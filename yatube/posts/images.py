@@ -0,0 +1,68 @@
+import os
+import tempfile
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.files import File
+from PIL import Image, ImageOps
+
+# Форматы, в которых сохраняем нормализованное изображение; прочие
+# перекодируются в JPEG.
+FORMATS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif', 'WEBP': '.webp'}
+
+NormalizedImage = namedtuple(
+    'NormalizedImage', ('file', 'width', 'height', 'format')
+)
+
+
+def _needs_rewrite(image):
+    if getattr(image, 'is_animated', False):
+        # Перекодирование потеряло бы анимацию.
+        return False
+    return (
+        max(image.size) > settings.POSTS_IMAGE_MAX_SIZE
+        or image.format not in FORMATS
+        or bool(image.getexif())
+        or 'exif' in image.info
+    )
+
+
+def normalize_image(upload):
+    """Приводит загруженное изображение к виду для хранения.
+
+    Уменьшает его до POSTS_IMAGE_MAX_SIZE по большей стороне, поворачивает
+    по EXIF и удаляет метаданные. Результат пишется во временный файл на
+    диске, а не в память. Изображение, которое менять не нужно,
+    возвращается как есть.
+    """
+    upload.seek(0)
+    image = Image.open(upload)
+    image_format = image.format
+    if not _needs_rewrite(image):
+        return NormalizedImage(upload, *image.size, image_format)
+    if image_format == 'JPEG':
+        # Декодер JPEG сразу уменьшает кадр в 2–8 раз, не читая
+        # полное разрешение.
+        limit = settings.POSTS_IMAGE_MAX_SIZE
+        image.draft('RGB', (limit, limit))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail(
+        (settings.POSTS_IMAGE_MAX_SIZE, settings.POSTS_IMAGE_MAX_SIZE),
+        Image.LANCZOS,
+    )
+    if image_format not in FORMATS:
+        image_format = 'JPEG'
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    extension = FORMATS[image_format]
+    output = tempfile.NamedTemporaryFile(suffix=extension)
+    # Без exif= и pnginfo= Pillow не переносит метаданные в новый файл.
+    image.save(
+        output,
+        image_format,
+        quality=settings.POSTS_IMAGE_QUALITY,
+        optimize=True,
+    )
+    output.seek(0)
+    name = os.path.splitext(os.path.basename(upload.name))[0] + extension
+    return NormalizedImage(File(output, name=name), *image.size, image_format)
@@ -0,0 +1,86 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.funcs import PAGES
+from posts.models import Post, User
+from posts.search import search_posts
+
+SYLLABLES = (
+    'ка ро ми ла по ре ту со не да ви ло ба ги ды жу зо ке лю мо ну пи ры '
+    'си ти фу хо це ча ше'
+).split()
+
+
+def make_vocabulary(size):
+    """Слова из слогов; частоты по закону Ципфа, как в живом тексте."""
+    words = set()
+    while len(words) < size:
+        words.add(''.join(random.choices(SYLLABLES, k=random.randint(2, 4))))
+    words = list(words)
+    weights = [1 / rank for rank in range(1, size + 1)]
+    return words, weights
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает поиск по индексу FTS5 с text__icontains на корпусе '
+        'случайных постов; созданные посты после замера удаляются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument(
+            '--queries', type=int, default=50,
+            help='Число запросов в каждой группе по частоте слов',
+        )
+        parser.add_argument('--vocabulary', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        words, weights = make_vocabulary(options['vocabulary'])
+        size = len(words)
+        # Слова отсортированы по частоте: сравниваем частые, средние и
+        # редкие запросы — у LIKE и FTS5 они стоят по-разному.
+        bands = {
+            'частые': words[:size // 100],
+            'средние': words[size // 100:size // 10],
+            'редкие': words[size // 10:],
+        }
+        with transaction.atomic():
+            self.seed(options['posts'], words, weights)
+            for name, band in bands.items():
+                queries = random.sample(band, options['queries'])
+                like = self.timed(
+                    lambda word: list(
+                        Post.objects.filter(text__icontains=word)
+                        .order_by('-created')[:PAGES]
+                    ),
+                    queries,
+                )
+                fts = self.timed(
+                    lambda word: list(search_posts(word)), queries
+                )
+                self.stdout.write(
+                    f'{name:>8}: icontains {like:6.2f} мс, '
+                    f'FTS5 {fts:6.2f} мс на запрос'
+                )
+            transaction.set_rollback(True)
+
+    def seed(self, count, words, weights):
+        author = User.objects.create_user(username='bench-search')
+        Post.objects.bulk_create(
+            Post(
+                author=author,
+                text=' '.join(random.choices(words, weights, k=40)),
+            )
+            for _ in range(count)
+        )
+
+    @staticmethod
+    def timed(search, queries):
+        started = time.perf_counter()
+        for query in queries:
+            search(query)
+        return (time.perf_counter() - started) / len(queries) * 1000
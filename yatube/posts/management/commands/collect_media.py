@@ -0,0 +1,282 @@
+import os
+import posixpath
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.helpers import deserialize
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.models import KVStore
+
+from core.models import StoredFile
+from posts.models import Post
+
+# Суффикс картинки, спрятанной на время последней проверки ссылок.
+COLLECTING = '.collecting'
+
+
+def walk_sorted(root, directory=''):
+    """Файлы под root/directory в порядке сортировки их путей.
+
+    В памяти держится только содержимое одного каталога: каталог
+    сортируется как «имя/», поэтому пути выходят в том же порядке,
+    что и ORDER BY по столбцу с этими путями.
+    """
+    try:
+        entries = list(os.scandir(os.path.join(root, directory)))
+    except FileNotFoundError:
+        return
+    entries.sort(
+        key=lambda entry: entry.name + '/'
+        if entry.is_dir(follow_symlinks=False) else entry.name
+    )
+    for entry in entries:
+        name = posixpath.join(directory, entry.name)
+        if entry.is_dir(follow_symlinks=False):
+            yield from walk_sorted(root, name)
+        elif entry.is_file(follow_symlinks=False):
+            yield name, entry
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def unreferenced(files, referenced):
+    """Файлы, которых нет в отсортированном потоке имен referenced."""
+    current = next(referenced, None)
+    for name, entry in files:
+        while current is not None and current < name:
+            current = next(referenced, None)
+        if current != name:
+            yield name, entry
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет из MEDIA_ROOT картинки постов и миниатюры, '
+        'на которые ничего не ссылается.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет удалено',
+        )
+        parser.add_argument(
+            '--quarantine',
+            help='Переносить файлы в этот каталог вместо удаления',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=3600,
+            help='Не трогать файлы моложе стольких секунд: их пост '
+                 'может быть еще не сохранен',
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.started = time.monotonic()
+        self.scanned = self.removed = self.freed = 0
+        self.cutoff = time.time() - options['min_age']
+        self.cutoff_time = timezone.now() - timedelta(
+            seconds=options['min_age']
+        )
+        upload_to = Post._meta.get_field('image').upload_to
+        self.collect_images(upload_to)
+        self.collect_thumbnail_records()
+        self.collect_thumbnail_files()
+        self.report('Готово')
+
+    def report(self, prefix):
+        elapsed = time.monotonic() - self.started
+        action = 'будет удалено' if self.options['dry_run'] else 'удалено'
+        self.stdout.write(
+            f'{prefix}: просмотрено {self.scanned} файлов '
+            f'({self.scanned / max(elapsed, 1e-6):.0f}/с), {action} '
+            f'{self.removed} на {self.freed / 2 ** 20:.1f} МБ'
+        )
+
+    def discard(self, name, path):
+        """Удаляет файл path или переносит его в карантин как name."""
+        size = os.path.getsize(path)
+        if self.options['quarantine']:
+            os.renames(path, os.path.join(self.options['quarantine'], name))
+        else:
+            os.remove(path)
+        self.removed += 1
+        self.freed += size
+
+    def remove(self, names):
+        """Удаляет или переносит в карантин файлы из MEDIA_ROOT."""
+        for name in names:
+            path = os.path.join(settings.MEDIA_ROOT, name)
+            try:
+                if self.options['dry_run']:
+                    self.removed += 1
+                    self.freed += os.path.getsize(path)
+                else:
+                    self.discard(name, path)
+            except FileNotFoundError:
+                continue
+
+    def scan(self, files):
+        """Считает просмотренные файлы и отсеивает слишком молодые."""
+        for name, entry in files:
+            self.scanned += 1
+            if self.scanned % 10000 == 0:
+                self.report('Идет сборка')
+            if entry.stat().st_mtime < self.cutoff:
+                yield name, entry
+
+    def collect_images(self, directory):
+        referenced = (
+            Post.objects
+            .filter(image__startswith=directory)
+            .order_by('image')
+            .values_list('image', flat=True)
+            .distinct()
+            .iterator()
+        )
+        files = self.scan(walk_sorted(settings.MEDIA_ROOT, directory))
+        for batch in chunked(
+            unreferenced(files, referenced), self.options['batch_size']
+        ):
+            names = [name for name, _ in batch]
+            held = self.held_images(names)
+            names = [name for name in names if name not in held]
+            if self.options['dry_run']:
+                self.remove(names)
+            else:
+                self.remove_images(names)
+
+    def held_images(self, names):
+        """Картинки из names, на которые есть ссылки или чей счетчик
+        ссылок менялся не раньше --min-age назад."""
+        return set(
+            StoredFile.objects
+            .filter(name__in=names)
+            .filter(Q(refs__gt=0) | Q(updated__gte=self.cutoff_time))
+            .values_list('name', flat=True)
+        )
+
+    def remove_images(self, names):
+        """Удаляет картинки, не давая гонки с повторной загрузкой.
+
+        HashedStorage.save не пишет файл, который уже есть, а только
+        добавляет ссылку; ссылку он добавляет до проверки файла. Поэтому
+        файл сначала прячется под временное имя и лишь потом ссылки
+        проверяются еще раз: загрузка, проверившая файл после этого,
+        запишет его заново, а файл, получивший ссылку, возвращается на
+        место. Содержимое у обоих одинаковое — имя задает хэш.
+        """
+        hidden = {}
+        for name in names:
+            path = os.path.join(settings.MEDIA_ROOT, name)
+            try:
+                os.rename(path, path + COLLECTING)
+            except FileNotFoundError:
+                continue
+            hidden[name] = path
+        held = self.held_images(list(hidden))
+        removed = []
+        for name, path in hidden.items():
+            if name in held:
+                os.replace(path + COLLECTING, path)
+                continue
+            self.discard(name, path + COLLECTING)
+            removed.append(name)
+        StoredFile.objects.filter(name__in=removed, refs=0).delete()
+
+    def collect_thumbnail_records(self):
+        """Удаляет миниатюры и записи sorl для картинок без постов."""
+        prefix = add_prefix('', 'thumbnails')
+        last = prefix
+        while True:
+            # Батчи по ключу, а не один курсор: ниже из этой же таблицы
+            # удаляются строки.
+            batch = list(
+                KVStore.objects
+                .filter(key__startswith=prefix, key__gt=last)
+                .order_by('key')
+                .values_list('key', 'value')[:self.options['batch_size']]
+            )
+            if not batch:
+                return
+            last = batch[-1][0]
+            source_keys = {
+                key[len(prefix):]: deserialize(value) for key, value in batch
+            }
+            dead = self.dead_sources(source_keys)
+            if dead:
+                self.drop_thumbnails(dead, source_keys)
+
+    def dead_sources(self, source_keys):
+        """Ключи sorl исходников, на которые не ссылается ни один пост."""
+        sources = dict(
+            KVStore.objects
+            .filter(key__in=[add_prefix(key) for key in source_keys])
+            .values_list('key', 'value')
+        )
+        names = {
+            key: deserialize_image_file(sources[add_prefix(key)]).name
+            for key in source_keys if add_prefix(key) in sources
+        }
+        live = set(
+            Post.objects
+            .filter(image__in=names.values())
+            .values_list('image', flat=True)
+        )
+        return [key for key in source_keys if names.get(key) not in live]
+
+    def drop_thumbnails(self, dead, source_keys):
+        thumbnail_keys = [
+            add_prefix(key) for source in dead for key in source_keys[source]
+        ]
+        thumbnails = KVStore.objects.filter(
+            key__in=thumbnail_keys
+        ).values_list('value', flat=True)
+        self.remove(
+            deserialize_image_file(value).name for value in thumbnails
+        )
+        if not self.options['dry_run']:
+            default.kvstore._delete_raw(
+                *thumbnail_keys,
+                *(add_prefix(key) for key in dead),
+                *(add_prefix(key, 'thumbnails') for key in dead),
+            )
+
+    def collect_thumbnail_files(self):
+        """Удаляет файлы миниатюр, о которых sorl ничего не знает."""
+        files = self.scan(walk_sorted(
+            settings.MEDIA_ROOT, thumbnail_settings.THUMBNAIL_PREFIX
+        ))
+        for batch in chunked(files, self.options['batch_size']):
+            keys = {
+                add_prefix(ImageFile(name, default.storage).key): name
+                for name, _ in batch
+            }
+            known = set(
+                KVStore.objects
+                .filter(key__in=keys)
+                .values_list('key', flat=True)
+            )
+            self.remove(
+                name for key, name in keys.items() if key not in known
+            )
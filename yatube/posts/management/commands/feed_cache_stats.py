@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from posts.cache import cache_stats, get_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Показывает счетчики кэша страниц лент.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Обнулить счетчики после вывода',
+        )
+
+    def handle(self, *args, **options):
+        for event, value in get_cache_stats().items():
+            self.stdout.write(f'{event}: {value}')
+        if options['reset']:
+            cache_stats.reset()
@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from PIL import Image
+
+from posts.models import Post
+from posts.thumbnails import generate_thumbnails
+
+
+def read_dimensions(name):
+    """Размеры и формат из заголовка файла, без декодирования."""
+    storage = Post._meta.get_field('image').storage
+    with storage.open(name) as file, Image.open(file) as image:
+        return image.width, image.height, image.format
+
+
+def generate(item):
+    name, width = item
+    try:
+        if width is None:
+            try:
+                width, height, image_format = read_dimensions(name)
+            except (OSError, ValueError):
+                pass
+            else:
+                Post.objects.filter(image=name).update(
+                    image_width=width,
+                    image_height=height,
+                    image_format=image_format,
+                )
+        generate_thumbnails(name, width)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = (
+        'Создает недостающие миниатюры для уже загруженных изображений '
+        'и дописывает размеры картинок старым постам.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Сколько изображений обрабатывать параллельно',
+        )
+
+    def handle(self, *args, **options):
+        images = (
+            Post.objects
+            .exclude(image='')
+            .order_by()
+            .values_list('image', 'image_width')
+            .distinct()
+        )
+        done = 0
+        # Уже созданные миниатюры sorl находит в хранилище и не пересоздает.
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for _ in executor.map(generate, images.iterator()):
+                done += 1
+                if done % 100 == 0:
+                    self.stdout.write(f'Обработано изображений: {done}')
+        self.stdout.write(f'Готово, изображений: {done}')
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+
+from posts.cache import forget_posts
+from posts.management.commands.recount import batches
+from posts.models import Post
+from posts.thumbnails import generate_thumbnails
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит картинки постов из плоского каталога в хранилище '
+        'с именами по хэшу содержимого.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument(
+            '--delete-old',
+            action='store_true',
+            help='Удалять старый файл после переключения всех его постов',
+        )
+
+    def handle(self, *args, **options):
+        storage = Post._meta.get_field('image').storage
+        moved = missing = 0
+        posts = Post.objects.exclude(image='')
+        for pks in batches(posts, options['batch_size']):
+            for pk, name, width in Post.objects.filter(pk__in=pks).values_list(
+                'pk', 'image', 'image_width'
+            ):
+                if storage.is_hashed(name):
+                    continue
+                if not storage.exists(name):
+                    missing += 1
+                    continue
+                # Старый файл остается на месте, пока пост не переключен,
+                # а миниатюры нового готовы заранее: страницы не ломаются
+                # ни на одном шаге.
+                with storage.open(name) as content:
+                    new_name = storage.save(name, content)
+                generate_thumbnails(new_name, width)
+                if not Post.objects.filter(pk=pk, image=name).update(
+                    image=new_name
+                ):
+                    # Картинку поста успели сменить.
+                    storage.release(new_name)
+                    continue
+                forget_posts([pk])
+                moved += 1
+                # Один плоский файл могут делить несколько постов: его
+                # удаляют, когда переключен последний из них.
+                if options['delete_old'] and not Post.objects.filter(
+                    image=name
+                ).exists():
+                    storage.delete(name)
+        self.stdout.write(
+            f'Перенесено картинок: {moved}, файлов не найдено: {missing}'
+        )
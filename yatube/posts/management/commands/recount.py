@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import Post, User, UserCounters
+
+
+def batches(queryset, size):
+    """Порциями отдает первичные ключи, двигаясь по индексу pk."""
+    last_pk = 0
+    while True:
+        pks = list(
+            queryset
+            .filter(pk__gt=last_pk)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:size]
+        )
+        if not pks:
+            return
+        yield pks
+        last_pk = pks[-1]
+
+
+class Command(BaseCommand):
+    help = 'Исправляет расхождения денормализованных счетчиков.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Сколько строк пересчитывать в одной транзакции',
+        )
+
+    def handle(self, *args, **options):
+        size = options['batch_size']
+        fixed_users = fixed_posts = 0
+        for pks in batches(User.objects.all(), size):
+            with transaction.atomic():
+                fixed_users += UserCounters.recount(pks)
+        for pks in batches(Post.objects.all(), size):
+            with transaction.atomic():
+                fixed_posts += Post.recount_comments(pks)
+        self.stdout.write(
+            f'Исправлено счетчиков пользователей: {fixed_users}, '
+            f'постов: {fixed_posts}'
+        )
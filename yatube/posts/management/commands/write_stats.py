@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from posts.writes import get_write_stats, write_stats
+
+
+class Command(BaseCommand):
+    help = 'Показывает размеры пакетов записей и время их фиксации.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Обнулить счетчики после вывода',
+        )
+
+    def handle(self, *args, **options):
+        stats = get_write_stats()
+        batches = max(stats['batches'], 1)
+        self.stdout.write(
+            f'пакетов: {stats["batches"]}, записей: {stats["writes"]}, '
+            f'не зафиксировано: {stats["failed"]}'
+        )
+        self.stdout.write(
+            f'средний пакет: {stats["writes"] / batches:.1f} записей, '
+            f'средняя фиксация: {stats["commit_us"] / batches / 1000:.2f} мс'
+        )
+        if options['reset']:
+            write_stats.reset()
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+
+def create_search(apps, schema_editor):
+    from posts.search import install_search, rebuild_search
+
+    if install_search(schema_editor.connection):
+        rebuild_search(schema_editor.connection)
+
+
+def drop_search(apps, schema_editor):
+    from posts.search import DROP_SCHEMA
+
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in DROP_SCHEMA:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search, drop_search),
+    ]
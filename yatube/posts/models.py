@@ -1,21 +1,46 @@
 from django.db import models
+from django.db.models import Count, F
 from django.contrib.auth import get_user_model
 
 from core.models import CreatedModel
+from core.storage import HashedStorage
 
 User = get_user_model()
 
 
+class PostQuerySet(models.QuerySet):
+    # Колонки автора и группы, которые нужны карточке поста в ленте:
+    # без хэша пароля и прочих полей auth_user и без описания группы.
+    FEED_FIELDS = (
+        'text', 'created', 'image', 'image_width', 'image_height',
+        'image_format', 'comments_count',
+        'author__username', 'author__first_name', 'author__last_name',
+        'group__title', 'group__slug',
+    )
+
+    def for_feed(self):
+        """Посты для ленты: автор и группа тем же запросом, только
+        колонки из FEED_FIELDS.
+
+        Ленты строятся от Post.objects, а не от group.posts: связанный
+        менеджер подставляет объект группы в каждый пост и ради этого
+        дочитывает отложенный group_id отдельным запросом.
+        """
+        return self.select_related('author', 'group').only(*self.FEED_FIELDS)
+
+
 class Post(CreatedModel):
     text = models.TextField(
         verbose_name='Текст поста',
         help_text='Введите текст нового поста',
     )
+    # Индексы по author и group — префиксы составных индексов в Meta.
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='posts',
         verbose_name='Автор',
+        db_index=False,
     )
     group = models.ForeignKey(
         'Group',
@@ -24,22 +49,86 @@ class Post(CreatedModel):
         null=True,
         related_name='posts',
         verbose_name='Группа',
+        db_index=False,
         help_text='Группа, к которой будет относиться пост',
     )
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=HashedStorage(),
+        blank=True,
+        db_index=True,
+    )
+    # Заполняются формой при загрузке, чтобы не открывать файл ради
+    # размеров; у старых постов их дописывает generate_thumbnails.
+    image_width = models.PositiveIntegerField(
+        'Ширина картинки',
+        null=True,
+        editable=False,
+    )
+    image_height = models.PositiveIntegerField(
+        'Высота картинки',
+        null=True,
+        editable=False,
+    )
+    image_format = models.CharField(
+        'Формат картинки',
+        max_length=10,
         blank=True,
+        editable=False,
+    )
+    comments_count = models.PositiveIntegerField(
+        'Комментариев',
+        default=0,
+        editable=False,
     )
 
+    objects = PostQuerySet.as_manager()
+
     class Meta:
         ordering = ('-created',)
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        # Ленты сортируются по (created, id) и листаются по этому ключу;
+        # SQLite читает индекс и в обратном порядке.
+        indexes = (
+            models.Index(
+                fields=('created', 'id'),
+                name='post_created_idx',
+            ),
+            models.Index(
+                fields=('author', 'created', 'id'),
+                name='post_author_created_idx',
+            ),
+            models.Index(
+                fields=('group', 'created', 'id'),
+                name='post_group_created_idx',
+            ),
+        )
 
     def __str__(self) -> str:
         return self.text[:15]
 
+    @classmethod
+    def recount_comments(cls, post_ids):
+        """Пересчитывает comments_count; возвращает число исправленных."""
+        counts = dict(
+            Comment.objects
+            .filter(post_id__in=post_ids)
+            .values('post_id')
+            .annotate(n=Count('pk'))
+            .values_list('post_id', 'n')
+        )
+        drifted = []
+        for post in cls.objects.filter(pk__in=post_ids).only(
+            'pk', 'comments_count'
+        ):
+            if post.comments_count != counts.get(post.pk, 0):
+                post.comments_count = counts.get(post.pk, 0)
+                drifted.append(post)
+        cls.objects.bulk_update(drifted, ['comments_count'])
+        return len(drifted)
+
 
 class Group(models.Model):
     title = models.CharField(max_length=200, verbose_name='Группа')
@@ -55,13 +144,36 @@ class Group(models.Model):
         return self.title
 
 
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def path_segment(pk):
+    """id комментария в base36 фиксированной ширины для пути в дереве."""
+    digits = ''
+    while pk:
+        pk, digit = divmod(pk, 36)
+        digits = DIGITS[digit] + digits
+    return digits.rjust(Comment.PATH_STEP, '0')
+
+
 class Comment(CreatedModel):
+    """Комментарий; ответы образуют дерево с материализованным путем.
+
+    path — цепочка id от корня ветки до самого комментария, по сегменту
+    PATH_STEP символов на уровень: сортировка по (thread, path) дает
+    обход ветки в глубину, а поддерево — это диапазон path внутри ветки.
+    """
+    MAX_DEPTH = 5
+    PATH_STEP = 8
+
     post = models.ForeignKey(
         Post,
         on_delete=models.CASCADE,
         blank=True,
         null=True,
         related_name='comments',
+        # Префикс индекса comment_post_created_idx.
+        db_index=False,
     )
     author = models.ForeignKey(
         User,
@@ -72,6 +184,128 @@ class Comment(CreatedModel):
         verbose_name='Текст',
         help_text='Текст нового комментария',
     )
+    parent = models.ForeignKey(
+        'self',
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+        related_name='replies',
+        verbose_name='Ответ на',
+    )
+    thread = models.ForeignKey(
+        'self',
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+        related_name='+',
+        editable=False,
+        # Префикс индекса comment_thread_path_idx.
+        db_index=False,
+    )
+    path = models.CharField(max_length=255, blank=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    replies_count = models.PositiveIntegerField(
+        'Ответов в ветке',
+        default=0,
+        editable=False,
+    )
+
+    class Meta:
+        indexes = (
+            # Страницы комментариев поста выбираются по ключу (created, id).
+            models.Index(
+                fields=('post', 'created', 'id'),
+                name='comment_post_created_idx',
+            ),
+            models.Index(
+                fields=('thread', 'path'),
+                name='comment_thread_path_idx',
+            ),
+        )
+
+    def tree_path(self):
+        # У комментариев, созданных в обход save(), путь не заполнен.
+        return self.path or path_segment(self.pk)
+
+    def ancestor_ids(self):
+        path = self.tree_path()
+        return [
+            int(path[i:i + self.PATH_STEP], 36)
+            for i in range(0, len(path) - self.PATH_STEP, self.PATH_STEP)
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.parent_id and self.parent.depth >= self.MAX_DEPTH:
+            # Ответ глубже предела становится ответом на тот же комментарий,
+            # что и его адресат.
+            self.parent = self.parent.parent
+        super().save(*args, **kwargs)
+        if not self.path:
+            parent = self.parent
+            self.path = (
+                parent.tree_path() if parent else ''
+            ) + path_segment(self.pk)
+            self.depth = parent.depth + 1 if parent else 0
+            self.thread_id = (
+                parent.thread_id or parent.pk if parent else self.pk
+            )
+            Comment.objects.filter(pk=self.pk).update(
+                path=self.path, depth=self.depth, thread=self.thread_id
+            )
+
+    def subtree(self):
+        """Все ответы в ветке под комментарием, в порядке обхода."""
+        path = self.tree_path()
+        return Comment.objects.filter(
+            thread_id=self.thread_id or self.pk,
+            path__gt=path,
+            path__lt=path + '~',
+        ).order_by('path')
+
+    @classmethod
+    def attach_replies(cls, threads, per_thread):
+        """Подгружает к корням веток первые per_thread ответов.
+
+        Ответы всех веток со страницы и их авторы читаются одним запросом
+        по индексу (thread, path); в ORM Django 2.2 нельзя фильтровать
+        по оконной функции, поэтому запрос написан на SQL. Ответы
+        кладутся в thread.shown_replies, число скрытых — в
+        thread.hidden_replies.
+        """
+        by_id = {thread.pk: thread for thread in threads}
+        for thread in threads:
+            thread.shown_replies = []
+            thread.hidden_replies = thread.replies_count
+        if not by_id:
+            return
+        comment_table = cls._meta.db_table
+        user_table = User._meta.db_table
+        placeholders = ', '.join(['%s'] * len(by_id))
+        replies = cls.objects.raw(
+            f'''
+            SELECT * FROM (
+                SELECT c.*, u.username AS author_username,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY c.thread_id ORDER BY c.path
+                    ) AS position
+                FROM {comment_table} c
+                JOIN {user_table} u ON u.id = c.author_id
+                WHERE c.thread_id IN ({placeholders}) AND c.depth > 0
+            )
+            WHERE position <= %s
+            ''',
+            [*by_id, per_thread],
+        )
+        # Строк не больше per_thread на ветку: отсортировать их здесь
+        # дешевле, чем отдавать ORDER BY временному B-дереву SQLite.
+        for reply in sorted(replies, key=lambda reply: reply.path):
+            reply.author = User(pk=reply.author_id,
+                                username=reply.author_username)
+            thread = by_id[reply.thread_id]
+            thread.shown_replies.append(reply)
+            thread.hidden_replies -= 1
+        for thread in threads:
+            thread.hidden_replies = max(thread.hidden_replies, 0)
 
 
 class Follow(models.Model):
@@ -84,12 +318,129 @@ class Follow(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='following',
+        db_index=False,
     )
 
     class Meta:
+        indexes = (
+            # Подписчики автора при раскладке поста читаются из индекса,
+            # без обращения к таблице.
+            models.Index(
+                fields=('author', 'user'),
+                name='follow_author_user_idx',
+            ),
+        )
         constraints = [
             models.UniqueConstraint(
                 fields=['user', 'author'],
                 name='unique_following',
             )
         ]
+
+
+class Timeline(models.Model):
+    """Материализованная лента подписок пользователя.
+
+    Заполняется при публикации поста (fan-out on write), поэтому лента
+    читается одним проходом по индексу (user, created).
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+    )
+    # Копия Post.created, чтобы сортировать без обращения к таблице постов.
+    created = models.DateTimeField()
+
+    class Meta:
+        ordering = ('-created', '-post')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_timeline_post',
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-created', '-post'],
+                name='timeline_user_created_idx',
+            ),
+        ]
+
+
+class UserCounters(models.Model):
+    """Денормализованные счетчики пользователя.
+
+    Поддерживаются сигналами через F()-выражения, так что страницы
+    не считают агрегаты при каждом запросе.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='counters',
+    )
+    posts_count = models.PositiveIntegerField('Постов', default=0)
+    followers_count = models.PositiveIntegerField('Подписчиков', default=0)
+    following_count = models.PositiveIntegerField('Подписок', default=0)
+
+    def __str__(self) -> str:
+        return f'Счетчики {self.user}'
+
+    @classmethod
+    def of(cls, user):
+        try:
+            return user.counters
+        except cls.DoesNotExist:
+            cls.recount([user.pk])
+            return cls.objects.get(pk=user.pk)
+
+    @classmethod
+    def bump(cls, user_id, field, delta):
+        queryset = cls.objects.filter(user_id=user_id)
+        if delta < 0:
+            # Не уходим в минус, если счетчик уже разошелся с данными.
+            queryset = queryset.filter(**{f'{field}__gte': -delta})
+        if not queryset.update(**{field: F(field) + delta}) and delta > 0:
+            cls.recount([user_id])
+
+    @classmethod
+    def recount(cls, user_ids):
+        """Пересчитывает счетчики; возвращает число исправленных строк."""
+        user_ids = list(
+            User.objects.filter(pk__in=user_ids).values_list('pk', flat=True)
+        )
+        sources = {
+            'posts_count': Post.objects.filter(author_id__in=user_ids)
+            .values_list('author_id'),
+            'followers_count': Follow.objects.filter(author_id__in=user_ids)
+            .values_list('author_id'),
+            'following_count': Follow.objects.filter(user_id__in=user_ids)
+            .values_list('user_id'),
+        }
+        counts = {
+            field: dict(queryset.annotate(n=Count('pk')).order_by())
+            for field, queryset in sources.items()
+        }
+        existing = cls.objects.in_bulk(user_ids)
+        created, drifted = [], []
+        for user_id in user_ids:
+            row = existing.get(user_id) or cls(user_id=user_id)
+            changed = False
+            for field in sources:
+                value = counts[field].get(user_id, 0)
+                if getattr(row, field) != value:
+                    setattr(row, field, value)
+                    changed = True
+            if user_id not in existing:
+                created.append(row)
+            elif changed:
+                drifted.append(row)
+        cls.objects.bulk_create(created, ignore_conflicts=True)
+        cls.objects.bulk_update(drifted, list(sources))
+        return len(created) + len(drifted)
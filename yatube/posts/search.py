@@ -0,0 +1,151 @@
+import base64
+import binascii
+import re
+
+from django.db import connection, connections, router
+
+from .funcs import PAGES, CursorPage
+from .models import Post
+
+SEARCH_TABLE = 'posts_post_fts'
+SEARCH_MIGRATION = ('posts', '0019_post_search')
+
+# Внешний индекс FTS5: текст хранится только в posts_post, а индекс
+# обновляют триггеры, так что его не обходят ни update(), ни bulk_create.
+# Пересоздание таблицы постов миграцией удаляет триггеры, поэтому они
+# создаются с IF NOT EXISTS и восстанавливаются после каждого migrate.
+SEARCH_SCHEMA = (
+    f'''CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+        text,
+        content='posts_post',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )''',
+    f'''CREATE TRIGGER IF NOT EXISTS posts_post_fts_insert
+    AFTER INSERT ON posts_post BEGIN
+        INSERT INTO {SEARCH_TABLE} (rowid, text) VALUES (NEW.id, NEW.text);
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS posts_post_fts_delete
+    AFTER DELETE ON posts_post BEGIN
+        INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, text)
+        VALUES ('delete', OLD.id, OLD.text);
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS posts_post_fts_update
+    AFTER UPDATE OF text ON posts_post BEGIN
+        INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, text)
+        VALUES ('delete', OLD.id, OLD.text);
+        INSERT INTO {SEARCH_TABLE} (rowid, text) VALUES (NEW.id, NEW.text);
+    END''',
+)
+DROP_SCHEMA = (
+    'DROP TRIGGER IF EXISTS posts_post_fts_insert',
+    'DROP TRIGGER IF EXISTS posts_post_fts_delete',
+    'DROP TRIGGER IF EXISTS posts_post_fts_update',
+    f'DROP TABLE IF EXISTS {SEARCH_TABLE}',
+)
+
+WORD = re.compile(r'\w+')
+
+
+def install_search(db=connection):
+    """Создает индекс и триггеры, если их нет. Возвращает False, если
+    база — не SQLite."""
+    if db.vendor != 'sqlite':
+        return False
+    with db.cursor() as cursor:
+        for statement in SEARCH_SCHEMA:
+            cursor.execute(statement)
+    return True
+
+
+def rebuild_search(db=connection):
+    """Заново строит индекс по всем постам и сжимает его."""
+    with db.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')"
+        )
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"
+        )
+
+
+def match_expression(query):
+    """Запрос пользователя в синтаксисе MATCH: все слова, каждое —
+    как префикс. Операторы FTS5 из ввода не проходят."""
+    return ' '.join(f'"{word}"*' for word in WORD.findall(query))
+
+
+def encode_search_cursor(rank, pk):
+    raw = f'{rank!r}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_search_cursor(token):
+    """Возвращает пару (rank, id) или None, если токен испорчен."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        rank, pk = raw.split('|')
+        return float(rank), int(pk)
+    except (ValueError, UnicodeError, binascii.Error):
+        return None
+
+
+class SearchPage(CursorPage):
+    """Страница результатов поиска; листается по ключу (rank, id)."""
+    @property
+    def next_cursor(self):
+        if self.has_next():
+            post = self.object_list[-1]
+            return encode_search_cursor(post.search_rank, post.pk)
+        return None
+
+    @property
+    def previous_cursor(self):
+        return None
+
+
+def matching_ids(query):
+    """SQL и параметры подзапроса с id постов, подходящих под query."""
+    return (
+        f'SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s',
+        [match_expression(query)],
+    )
+
+
+def search_posts(query, after=None, per_page=PAGES):
+    """Посты, подходящие под query, от более релевантных к менее.
+
+    rank — оценка bm25 из FTS5 (чем меньше, тем лучше); страница
+    выбирается по ключу (rank, id), без OFFSET.
+    """
+    expression = match_expression(query)
+    if not expression:
+        return SearchPage([], has_next=False, has_previous=False)
+    sql = (
+        f'SELECT rowid, rank FROM {SEARCH_TABLE} '
+        f'WHERE {SEARCH_TABLE} MATCH %s'
+    )
+    params = [expression]
+    if after is not None:
+        rank, pk = after
+        sql += ' AND (rank > %s OR (rank = %s AND rowid > %s))'
+        params += [rank, rank, pk]
+    sql += ' ORDER BY rank, rowid LIMIT %s'
+    params.append(per_page + 1)
+    with connections[router.db_for_read(Post)].cursor() as cursor:
+        cursor.execute(sql, params)
+        found = cursor.fetchall()
+    posts = Post.objects.for_feed().in_bulk(
+        [pk for pk, _ in found[:per_page]]
+    )
+    page = []
+    for pk, rank in found[:per_page]:
+        if pk in posts:
+            posts[pk].search_rank = rank
+            page.append(posts[pk])
+    return SearchPage(
+        page,
+        has_next=len(found) > per_page,
+        has_previous=after is not None,
+    )
@@ -0,0 +1,157 @@
+from django.db import connections
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models import F
+from django.db.models.signals import (
+    post_delete, post_migrate, post_save, pre_delete, pre_save,
+)
+from django.dispatch import receiver
+
+from .cache import bump_generations, forget_posts, post_scopes
+from .models import Comment, Follow, Group, Post, User, UserCounters
+from .search import SEARCH_MIGRATION, install_search
+from .thumbnails import schedule_thumbnails
+from .timeline import (
+    author_unfollowed, backfill_timeline, fan_out_post, forget_recent_posts,
+    remove_from_timeline,
+)
+
+
+@receiver(post_migrate)
+def search_migrated(sender, using, **kwargs):
+    # Миграция, пересоздающая таблицу постов, удаляет и ее триггеры.
+    # После отката до миграции поиска индекс не возвращаем.
+    if sender.name != 'posts':
+        return
+    db = connections[using]
+    if SEARCH_MIGRATION in MigrationRecorder(db).applied_migrations():
+        install_search(db)
+
+
+# Поля автора и группы, которые кэш объектов хранит вместе с постом.
+AUTHOR_FIELDS = {'username', 'first_name', 'last_name'}
+GROUP_FIELDS = {'title', 'slug'}
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields, **kwargs):
+    if created:
+        UserCounters.objects.get_or_create(user=instance)
+    elif update_fields is None or AUTHOR_FIELDS & set(update_fields):
+        # Вход сохраняет только last_login и кэш не трогает.
+        forget_posts(instance.posts.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, update_fields, **kwargs):
+    if not created and (
+        update_fields is None or GROUP_FIELDS & set(update_fields)
+    ):
+        forget_posts(instance.posts.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleting(sender, instance, **kwargs):
+    # SET_NULL обнуляет group у постов одним UPDATE без сигналов, и
+    # после удаления их уже не найти по группе.
+    instance._post_ids = list(instance.posts.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    forget_posts(getattr(instance, '_post_ids', []))
+
+
+@receiver(pre_save, sender=Post)
+def post_saving(sender, instance, **kwargs):
+    old = Post.objects.filter(pk=instance.pk).values(
+        'group_id', 'image'
+    ).first() if instance.pk else None
+    old = old or {'group_id': None, 'image': ''}
+    instance._old_group_id = old['group_id']
+    instance._old_image = old['image']
+    # Файл сохранится в хранилище позже, в pre_save поля, и добавит
+    # ссылку на себя.
+    instance._image_uploaded = bool(instance.image) and (
+        not instance.image._committed
+    )
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    old_image = getattr(instance, '_old_image', '')
+    if instance.image.name != old_image:
+        if instance.image:
+            schedule_thumbnails(instance.image.name, instance.image_width)
+        if old_image:
+            instance.image.storage.release(old_image)
+    elif old_image and getattr(instance, '_image_uploaded', False):
+        # Загружена та же картинка: у поста одна ссылка, а не две.
+        instance.image.storage.release(old_image)
+    if created:
+        UserCounters.bump(instance.author_id, 'posts_count', 1)
+        fan_out_post(instance)
+        bump_generations(post_scopes(instance))
+        return
+    forget_posts([instance.pk])
+    old_group_id = getattr(instance, '_old_group_id', None)
+    if old_group_id != instance.group_id:
+        # Пост, перенесенный в другую группу, должен пропасть из старой
+        # и появиться в новой.
+        bump_generations(
+            f'group:{slug}' for slug in Group.objects.filter(
+                pk__in=[old_group_id, instance.group_id]
+            ).values_list('slug', flat=True)
+        )
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    UserCounters.bump(instance.author_id, 'posts_count', -1)
+    forget_recent_posts(instance.author_id)
+    forget_posts([instance.pk])
+    bump_generations(post_scopes(instance))
+    if instance.image:
+        instance.image.storage.release(instance.image.name)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created and instance.parent_id:
+        parent = instance.parent
+        Comment.objects.filter(
+            pk__in=parent.ancestor_ids() + [parent.pk]
+        ).update(replies_count=F('replies_count') + 1)
+    if created and instance.post_id:
+        Post.objects.filter(pk=instance.post_id).update(
+            comments_count=F('comments_count') + 1
+        )
+        forget_posts([instance.post_id])
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    Comment.objects.filter(
+        pk__in=instance.ancestor_ids(), replies_count__gt=0,
+    ).update(replies_count=F('replies_count') - 1)
+    if instance.post_id:
+        Post.objects.filter(
+            pk=instance.post_id,
+            comments_count__gt=0,
+        ).update(comments_count=F('comments_count') - 1)
+        forget_posts([instance.post_id])
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, **kwargs):
+    if created:
+        UserCounters.bump(instance.author_id, 'followers_count', 1)
+        UserCounters.bump(instance.user_id, 'following_count', 1)
+        backfill_timeline(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    UserCounters.bump(instance.author_id, 'followers_count', -1)
+    UserCounters.bump(instance.user_id, 'following_count', -1)
+    remove_from_timeline(instance.user_id, instance.author_id)
+    author_unfollowed(instance.author_id)
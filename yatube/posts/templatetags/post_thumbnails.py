@@ -0,0 +1,32 @@
+from django import template
+from django.conf import settings
+
+from ..thumbnails import ready_variants
+
+register = template.Library()
+
+
+def srcset(variants):
+    return ', '.join(
+        f'{thumbnail.url} {width}w' for width, thumbnail in variants
+    )
+
+
+@register.inclusion_tag('posts/includes/post_image.html')
+def post_image(image):
+    """Миниатюра поста в <picture> с srcset по всем готовым вариантам."""
+    variants = ready_variants(image)
+    fallback_format = settings.POSTS_THUMBNAIL_FORMATS[-1]
+    fallback = variants.pop(fallback_format, None)
+    if not fallback:
+        return {}
+    return {
+        'image': fallback[-1][1],
+        'srcset': srcset(fallback),
+        'sources': [
+            (f'image/{image_format.lower()}', srcset(variants[image_format]))
+            for image_format in settings.POSTS_THUMBNAIL_FORMATS
+            if image_format in variants
+        ],
+        'sizes': settings.POSTS_THUMBNAIL_SIZES,
+    }
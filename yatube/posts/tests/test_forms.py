@@ -1,3 +1,4 @@
+import io
 import shutil
 import tempfile
 
@@ -5,9 +6,13 @@ from django.contrib.auth import get_user_model
 from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 from django.conf import settings
+from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import SimpleUploadedFile
 
 from http import HTTPStatus
+from PIL import Image
+
+from core.storage import HashedStorage
 
 from ..models import User, Group, Post, Comment
 
@@ -74,10 +79,38 @@ class PostCreateFormTests(TestCase):
                 text=form_data['text'],
                 group=form_data['group'],
                 author=self.user,
-                image='posts/small.gif'
+                image=HashedStorage().hashed_name(
+                    'posts/small.gif', ContentFile(small_gif)
+                ),
             ).exists()
         )
 
+    @override_settings(POSTS_IMAGE_MAX_SIZE=100)
+    def test_uploaded_image_normalized(self):
+        """Большая картинка уменьшается, теряет EXIF, а ее размеры
+        и формат сохраняются в посте."""
+        exif = Image.Exif()
+        exif[0x0110] = 'Тестовая камера'
+        buffer = io.BytesIO()
+        Image.new('RGB', (300, 200), 'red').save(buffer, 'JPEG', exif=exif)
+        uploaded = SimpleUploadedFile(
+            name='big.jpg',
+            content=buffer.getvalue(),
+            content_type='image/jpeg',
+        )
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'Большая картинка', 'image': uploaded},
+        )
+        post = Post.objects.get(text='Большая картинка')
+        self.assertEqual(
+            (post.image_width, post.image_height, post.image_format),
+            (100, 67, 'JPEG'),
+        )
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (100, 67))
+            self.assertFalse(image.getexif())
+
     def test_edit_post_authorized_client(self):
         """Валидная форма правит запись в Post."""
         self.post = Post.objects.create(
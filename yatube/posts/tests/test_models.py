@@ -1,7 +1,14 @@
+from io import StringIO
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
-from ..models import Group, Post
+from ..management.commands.check_query_plans import bad_steps
+from ..models import Comment, Follow, Group, Post, UserCounters
 
 User = get_user_model()
 
@@ -61,3 +68,155 @@ class PostModelTest(TestCase):
                 self.assertEqual(
                     post._meta.get_field(field).help_text,
                     expected_value)
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='ТестАвтор')
+        cls.reader = User.objects.create_user(username='ТестЧитатель')
+
+    def counters(self, user):
+        return UserCounters.objects.get(user=user)
+
+    def test_counters_follow_changes(self):
+        """Счетчики меняются вместе с постами, комментариями и подписками."""
+        post = Post.objects.create(text='Тестовый пост', author=self.author)
+        comment = Comment.objects.create(
+            post=post, author=self.reader, text='Комментарий'
+        )
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(self.counters(self.author).posts_count, 1)
+        self.assertEqual(self.counters(self.author).followers_count, 1)
+        self.assertEqual(self.counters(self.reader).following_count, 1)
+        comment.delete()
+        follow.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        self.assertEqual(self.counters(self.author).followers_count, 0)
+        self.assertEqual(self.counters(self.reader).following_count, 0)
+        post.delete()
+        self.assertEqual(self.counters(self.author).posts_count, 0)
+
+    def test_recount_repairs_drift(self):
+        """Команда recount исправляет разошедшиеся счетчики."""
+        post = Post.objects.create(text='Тестовый пост', author=self.author)
+        Comment.objects.create(post=post, author=self.reader, text='Текст')
+        UserCounters.objects.update(posts_count=7)
+        UserCounters.objects.filter(user=self.reader).delete()
+        Post.objects.update(comments_count=5)
+        call_command('recount', batch_size=1, stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(self.counters(self.author).posts_count, 1)
+        self.assertEqual(self.counters(self.reader).posts_count, 0)
+
+    def test_profile_does_not_count_posts(self):
+        """Страница профиля не считает посты агрегатным запросом."""
+        Post.objects.create(text='Тестовый пост', author=self.author)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse('posts:profile', kwargs={'username': 'ТестАвтор'})
+            )
+        self.assertEqual(response.context['num_posts'], 1)
+        count_queries = [
+            query['sql'] for query in queries
+            if 'COUNT(' in query['sql'] and '"posts_post"."author_id"'
+            in query['sql'] and 'LIMIT' not in query['sql']
+        ]
+        self.assertEqual(count_queries, [])
+
+
+class CommentThreadTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(author=cls.user, text='Тестовый пост')
+
+    def reply(self, parent, text='Ответ'):
+        return Comment.objects.create(
+            post=self.post, author=self.user, text=text, parent=parent,
+        )
+
+    def test_reply_path_and_depth_limit(self):
+        """Ответ продолжает путь родителя, а глубже предела
+        становится соседом адресата."""
+        comment = root = self.reply(None)
+        self.assertEqual(root.thread_id, root.pk)
+        for depth in range(1, Comment.MAX_DEPTH + 1):
+            comment = self.reply(comment)
+            self.assertEqual(comment.depth, depth)
+            self.assertTrue(comment.path.startswith(comment.parent.path))
+            self.assertEqual(comment.thread_id, root.pk)
+        deepest = self.reply(comment)
+        self.assertEqual(deepest.depth, Comment.MAX_DEPTH)
+        self.assertEqual(deepest.parent_id, comment.parent_id)
+        self.assertEqual(
+            [reply.pk for reply in root.subtree()],
+            [reply.pk for reply in Comment.objects.filter(
+                thread=root, depth__gt=0
+            ).order_by('path')],
+        )
+
+    def test_replies_count_follows_changes(self):
+        """Счетчик ответов есть у всех предков и уменьшается
+        при удалении."""
+        root = self.reply(None)
+        child = self.reply(root)
+        grandchild = self.reply(child)
+        self.reply(root)
+        root.refresh_from_db()
+        child.refresh_from_db()
+        self.assertEqual((root.replies_count, child.replies_count), (3, 1))
+        grandchild.delete()
+        root.refresh_from_db()
+        self.assertEqual(root.replies_count, 2)
+
+    def test_attach_replies_single_query(self):
+        """Первые ответы всех веток приходят одним запросом."""
+        roots = [self.reply(None, f'Ветка {i}') for i in range(3)]
+        for root in roots:
+            child = self.reply(root, f'{root.text}.1')
+            self.reply(child, f'{root.text}.1.1')
+            self.reply(root, f'{root.text}.2')
+        for root in roots:
+            root.refresh_from_db()
+        with self.assertNumQueries(1):
+            Comment.attach_replies(roots, 2)
+            texts = [
+                [(reply.text, reply.author.username)
+                 for reply in root.shown_replies]
+                for root in roots
+            ]
+        self.assertEqual(texts, [
+            [(f'Ветка {i}.1', 'auth'), (f'Ветка {i}.1.1', 'auth')]
+            for i in range(3)
+        ])
+        self.assertEqual([root.hidden_replies for root in roots], [1] * 3)
+
+
+class QueryPlansTest(TestCase):
+    def test_views_use_indexes(self):
+        """Запросы представлений posts не читают таблицы целиком
+        и не сортируют во временном B-дереве."""
+        out = StringIO()
+        call_command('check_query_plans', seed=30, stdout=out)
+        self.assertIn('Все планы используют индексы', out.getvalue())
+        self.assertFalse(Post.objects.exists())
+
+    def test_bad_steps(self):
+        plan = [
+            (2, 0, 0, 'CO-ROUTINE (subquery-1)'),
+            (5, 2, 0, 'SEARCH c USING INDEX comment_thread_path_idx'),
+            (9, 0, 0, 'SCAN (subquery-1)'),
+            (11, 0, 0, 'SCAN posts_post'),
+            (20, 0, 0, 'SCAN posts_post USING INDEX post_created_idx'),
+            (30, 0, 0, 'USE TEMP B-TREE FOR ORDER BY'),
+        ]
+        self.assertEqual(
+            bad_steps(plan),
+            ['SCAN posts_post', 'USE TEMP B-TREE FOR ORDER BY'],
+        )
@@ -0,0 +1,114 @@
+from io import StringIO
+
+from django.apps import apps
+from django.contrib.admin.sites import site
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.recorder import MigrationRecorder
+from django.test import Client, RequestFactory, TestCase
+from django.urls import reverse
+
+from ..funcs import PAGES
+from ..models import Post
+from ..search import (
+    DROP_SCHEMA, SEARCH_MIGRATION, SEARCH_TABLE, match_expression,
+    search_posts,
+)
+from ..signals import search_migrated
+
+User = get_user_model()
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='ТестАвтор')
+        cls.post = Post.objects.create(
+            text='Котики любят спать на солнце', author=cls.user
+        )
+        Post.objects.bulk_create(
+            Post(text=f'Собака номер {i}', author=cls.user)
+            for i in range(PAGES + 3)
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_triggers_follow_text(self):
+        """Индекс следует за созданием, правкой и удалением постов."""
+        self.assertEqual(list(search_posts('котик')), [self.post])
+        Post.objects.filter(pk=self.post.pk).update(text='Попугай')
+        self.assertEqual(list(search_posts('котик')), [])
+        self.assertEqual(list(search_posts('ПОПУГАЙ')), [self.post])
+        self.post.delete()
+        self.assertEqual(list(search_posts('попугай')), [])
+
+    def test_cursor_pages(self):
+        """Результаты листаются по курсору без повторов и пропусков."""
+        first = search_posts('собака')
+        self.assertEqual(len(first), PAGES)
+        self.assertTrue(first.has_next())
+        response = Client().get(
+            reverse('posts:search'),
+            {'q': 'собака', 'after': first.next_cursor},
+        )
+        second = response.context['page_obj']
+        self.assertEqual(len(second), 3)
+        self.assertFalse(second.has_next())
+        found = {post.pk for post in [*first, *second]}
+        self.assertEqual(len(found), PAGES + 3)
+        self.assertNotIn(self.post.pk, found)
+
+    def test_query_syntax_is_escaped(self):
+        """Операторы FTS5 во вводе ищутся как обычные слова."""
+        self.assertEqual(match_expression('кот OR "соба'), (
+            '"кот"* "OR"* "соба"*'
+        ))
+        for query in ('"', 'NEAR(', '*', '', 'кот -собака'):
+            with self.subTest(query=query):
+                response = Client().get(reverse('posts:search'), {'q': query})
+                self.assertEqual(response.status_code, 200)
+
+    def test_admin_search_uses_index(self):
+        """Поиск в админке идет по индексу FTS5."""
+        model_admin = site._registry[Post]
+        request = RequestFactory().get('/admin/posts/post/')
+        queryset, distinct = model_admin.get_search_results(
+            request, Post.objects.all(), 'котики'
+        )
+        self.assertIn(SEARCH_TABLE, str(queryset.query))
+        self.assertEqual(list(queryset), [self.post])
+        self.assertFalse(distinct)
+
+    def test_migrate_back_keeps_index_dropped(self):
+        """После отката миграции поиска post_migrate не создает индекс
+        заново."""
+        def search_table_exists():
+            return SEARCH_TABLE in connection.introspection.table_names()
+
+        recorder = MigrationRecorder(connection)
+        with connection.cursor() as cursor:
+            for statement in DROP_SCHEMA:
+                cursor.execute(statement)
+        recorder.record_unapplied(*SEARCH_MIGRATION)
+        posts_app = apps.get_app_config('posts')
+        search_migrated(sender=posts_app, using='default')
+        self.assertFalse(search_table_exists())
+        recorder.record_applied(*SEARCH_MIGRATION)
+        search_migrated(sender=posts_app, using='default')
+        self.assertTrue(search_table_exists())
+
+    def test_index_posts(self):
+        """index_posts строит индекс заново по всем постам."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) "
+                f"VALUES ('delete-all')"
+            )
+        self.assertEqual(list(search_posts('котики')), [])
+        out = StringIO()
+        call_command('index_posts', stdout=out)
+        self.assertIn(f'Проиндексировано постов: {PAGES + 4}', out.getvalue())
+        self.assertEqual(list(search_posts('котики')), [self.post])
@@ -0,0 +1,307 @@
+import io
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from sorl.thumbnail import default
+
+from core.models import StoredFile
+
+from ..management.commands.collect_media import Command
+from ..models import Post, User
+from ..thumbnails import (
+    generate_thumbnails, prefetch_thumbnails, ready_thumbnail,
+    thumbnail_variants,
+)
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='ТестАвтор')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def create_post(self, content=SMALL_GIF):
+        return Post.objects.create(
+            text='Пост с картинкой',
+            author=self.user,
+            image=SimpleUploadedFile('small.gif', content, 'image/gif'),
+        )
+
+    def test_placeholder_until_thumbnail_ready(self):
+        """Пока миниатюры нет, вместо нее выводится заглушка,
+        после генерации — сама миниатюра."""
+        post = self.create_post()
+        url = reverse('posts:post_detail', kwargs={'post_id': post.pk})
+        response = self.client.get(url)
+        self.assertContains(response, 'aspect-ratio')
+        self.assertNotContains(response, 'card-img my-2" src')
+        generate_thumbnails(post.image.name)
+        thumbnail = ready_thumbnail(
+            post.image, '960x339', crop='center', upscale=True
+        )
+        self.assertIsNotNone(thumbnail)
+        response = self.client.get(url)
+        self.assertContains(response, thumbnail.url)
+        self.assertContains(response, 'loading="lazy"')
+        for width in settings.POSTS_THUMBNAIL_WIDTHS:
+            self.assertContains(response, f' {width}w')
+
+    def test_thumbnails_scheduled_on_image_change(self):
+        """Генерация ставится в очередь, только когда меняется картинка."""
+        with mock.patch('posts.signals.schedule_thumbnails') as schedule:
+            post = self.create_post()
+            schedule.assert_called_once_with(post.image.name, None)
+            post.text = 'Другой текст'
+            post.save()
+            schedule.assert_called_once()
+
+    def test_prefetch_uses_one_cache_round_trip(self):
+        """Миниатюры страницы читаются одним get_many, после чего
+        ready_thumbnail не обращается к хранилищу sorl."""
+        posts = []
+        for color in ('red', 'green', 'blue'):
+            buffer = io.BytesIO()
+            Image.new('RGB', (4, 4), color).save(buffer, 'GIF')
+            posts.append(self.create_post(buffer.getvalue()))
+        for post in posts[:2]:
+            generate_thumbnails(post.image.name)
+        posts = list(Post.objects.filter(pk__in=[post.pk for post in posts]))
+        kv_cache = default.kvstore.cache
+        with mock.patch.object(
+            kv_cache, 'get_many', wraps=kv_cache.get_many
+        ) as get_many:
+            prefetch_thumbnails(posts)
+        get_many.assert_called_once()
+        with mock.patch.object(
+            default.kvstore, '_get_raw', side_effect=AssertionError
+        ):
+            ready = [
+                ready_thumbnail(
+                    post.image, '960x339', crop='center', upscale=True
+                )
+                for post in sorted(posts, key=lambda post: post.pk)
+            ]
+        self.assertIsNotNone(ready[0])
+        self.assertIsNotNone(ready[1])
+        self.assertIsNone(ready[2])
+
+    @override_settings(POSTS_THUMBNAIL_FORMATS=('AVIF', 'WEBP', 'JPEG'))
+    def test_variants_skip_unsupported_formats(self):
+        """Варианты есть для каждой ширины в формате, который Pillow
+        умеет сохранять, и пропускаются для остальных."""
+        with mock.patch('PIL.Image.SAVE', {'JPEG': None, 'WEBP': None}):
+            variants = thumbnail_variants()
+        self.assertEqual(
+            [(image_format, width) for image_format, width, _, _ in variants],
+            [
+                (image_format, width)
+                for image_format in ('WEBP', 'JPEG')
+                for width in sorted(settings.POSTS_THUMBNAIL_WIDTHS)
+            ],
+        )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MigrateMediaTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='ТестАвтор')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_flat_files_moved_to_hashed_names(self):
+        """Картинки из плоского каталога переносятся в хранилище по хэшу,
+        одинаковые — в один файл."""
+        storage = Post._meta.get_field('image').storage
+        names = [
+            FileSystemStorage().save(name, ContentFile(SMALL_GIF))
+            for name in ('posts/one.gif', 'posts/two.gif')
+        ]
+        posts = [
+            Post.objects.create(text='Старый пост', author=self.user,
+                                image=name)
+            for name in names
+        ]
+        call_command('migrate_media', '--delete-old', stdout=io.StringIO())
+        new_names = {
+            Post.objects.get(pk=post.pk).image.name for post in posts
+        }
+        self.assertEqual(len(new_names), 1)
+        (new_name,) = new_names
+        self.assertTrue(storage.is_hashed(new_name))
+        self.assertTrue(storage.exists(new_name))
+        self.assertEqual(StoredFile.objects.get(name=new_name).refs, 2)
+        for name in names:
+            self.assertFalse(storage.exists(name))
+
+    def test_shared_flat_file_kept_until_all_posts_moved(self):
+        """Общий для нескольких постов плоский файл удаляется только после
+        переключения всех этих постов."""
+        storage = Post._meta.get_field('image').storage
+        name = FileSystemStorage().save('posts/shared.gif',
+                                        ContentFile(SMALL_GIF))
+        posts = [
+            Post.objects.create(text='Старый пост', author=self.user,
+                                image=name)
+            for _ in range(3)
+        ]
+        call_command('migrate_media', '--delete-old', '--batch-size', '1',
+                     stdout=io.StringIO())
+        new_names = {
+            Post.objects.get(pk=post.pk).image.name for post in posts
+        }
+        self.assertEqual(len(new_names), 1)
+        (new_name,) = new_names
+        self.assertTrue(storage.is_hashed(new_name))
+        self.assertEqual(StoredFile.objects.get(name=new_name).refs, 3)
+        self.assertFalse(storage.exists(name))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class CollectMediaTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='ТестАвтор')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create_post(self, color):
+        buffer = io.BytesIO()
+        Image.new('RGB', (4, 4), color).save(buffer, 'GIF')
+        post = Post.objects.create(
+            text='Пост с картинкой',
+            author=self.user,
+            image=SimpleUploadedFile('small.gif', buffer.getvalue()),
+        )
+        generate_thumbnails(post.image.name)
+        return post
+
+    def thumbnail_names(self, post):
+        return [
+            ready_thumbnail(post.image, geometry, **options).name
+            for _, _, geometry, options in thumbnail_variants()
+        ]
+
+    def test_orphans_removed(self):
+        """Сборщик удаляет картинки без постов, их миниатюры и миниатюры,
+        неизвестные sorl, а живые файлы оставляет."""
+        storage = FileSystemStorage()
+        live = self.create_post('red')
+        dead = self.create_post('blue')
+        dead_files = [dead.image.name] + self.thumbnail_names(dead)
+        dead.delete()
+        live_files = [live.image.name] + self.thumbnail_names(live)
+        stray = storage.save('posts/stray.gif', ContentFile(SMALL_GIF))
+        unknown = storage.save('cache/00/00/unknown.jpg', ContentFile(b'x'))
+        orphans = dead_files + [stray, unknown]
+        call_command(
+            'collect_media', '--dry-run', '--min-age=-60',
+            stdout=io.StringIO(),
+        )
+        for name in orphans:
+            self.assertTrue(storage.exists(name))
+        out = io.StringIO()
+        call_command('collect_media', '--min-age=-60', stdout=out)
+        for name in orphans:
+            self.assertFalse(storage.exists(name), name)
+        for name in live_files:
+            self.assertTrue(storage.exists(name), name)
+        self.assertIn(f'удалено {len(orphans)}', out.getvalue())
+
+    def test_same_image_reupload_keeps_one_reference(self):
+        """Повторная загрузка той же картинки в пост не добавляет ссылку."""
+        post = self.create_post('red')
+        name = post.image.name
+        buffer = io.BytesIO()
+        Image.new('RGB', (4, 4), 'red').save(buffer, 'GIF')
+        for _ in range(2):
+            post.image = SimpleUploadedFile('again.gif', buffer.getvalue())
+            post.save()
+        self.assertEqual(post.image.name, name)
+        self.assertEqual(StoredFile.objects.get(name=name).refs, 1)
+        post.delete()
+        self.assertEqual(StoredFile.objects.get(name=name).refs, 0)
+
+    def orphan_image(self):
+        """Картинка без ссылок, записанная давно."""
+        storage = Post._meta.get_field('image').storage
+        name = storage.save('posts/small.gif', ContentFile(SMALL_GIF))
+        storage.release(name)
+        StoredFile.objects.filter(name=name).update(
+            updated=timezone.now() - timedelta(hours=2)
+        )
+        os.utime(storage.path(name), (0, 0))
+        return storage, name
+
+    def test_reupload_during_collection_kept(self):
+        """Загрузка той же картинки во время сборки не теряет файл."""
+        storage, name = self.orphan_image()
+        held_images = Command.held_images
+        calls = []
+
+        def reupload(command, names):
+            calls.append(names)
+            if len(calls) == 2:
+                # Сборщик уже спрятал файл: загрузка запишет его заново.
+                storage.save('posts/again.gif', ContentFile(SMALL_GIF))
+            return held_images(command, names)
+
+        with mock.patch.object(Command, 'held_images', reupload):
+            call_command('collect_media', stdout=io.StringIO())
+        self.assertEqual(calls[1], [name])
+        self.assertTrue(storage.exists(name))
+        self.assertEqual(StoredFile.objects.get(name=name).refs, 1)
+
+    def test_recently_released_image_kept(self):
+        """Картинка, чьи ссылки менялись позже --min-age, остается."""
+        storage, name = self.orphan_image()
+        StoredFile.objects.filter(name=name).update(updated=timezone.now())
+        call_command('collect_media', stdout=io.StringIO())
+        self.assertTrue(storage.exists(name))
+        StoredFile.objects.filter(name=name).update(
+            updated=timezone.now() - timedelta(hours=2)
+        )
+        call_command('collect_media', stdout=io.StringIO())
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
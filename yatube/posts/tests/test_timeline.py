@@ -0,0 +1,184 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Follow, Post, Timeline
+
+User = get_user_model()
+
+
+@override_settings(POSTS_TIMELINE_LENGTH=3)
+class TimelineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='ТестАвтор')
+        cls.reader = User.objects.create_user(username='ТестЧитатель')
+
+    def timeline(self):
+        return list(
+            Timeline.objects
+            .filter(user=self.reader)
+            .values_list('post_id', flat=True)
+        )
+
+    def test_new_post_fans_out_to_followers(self):
+        """Новый пост попадает в ленты подписчиков автора."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text='Тестовый текст', author=self.author)
+        self.assertEqual(self.timeline(), [post.pk])
+
+    def test_timeline_is_trimmed(self):
+        """Длина ленты ограничена POSTS_TIMELINE_LENGTH."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        posts = [
+            Post.objects.create(text=f'Тестовый текст{i}', author=self.author)
+            for i in range(5)
+        ]
+        self.assertEqual(
+            self.timeline(), [post.pk for post in posts[:-4:-1]]
+        )
+
+    def test_fan_out_cost_does_not_grow_with_followers(self):
+        """Раскладка поста обрезает ленты всех подписчиков одним
+        запросом."""
+        readers = [self.reader] + [
+            User.objects.create_user(username=f'ТестЧитатель{i}')
+            for i in range(5)
+        ]
+        for reader in readers:
+            Follow.objects.create(user=reader, author=self.author)
+        for i in range(3):
+            Post.objects.create(text=f'Тестовый текст{i}', author=self.author)
+        with CaptureQueriesContext(connection) as queries:
+            post = Post.objects.create(text='Новый пост', author=self.author)
+        trims = [
+            query for query in queries
+            if query['sql'].startswith('DELETE')
+        ]
+        self.assertEqual(len(trims), 1)
+        for reader in readers:
+            entries = Timeline.objects.filter(user=reader)
+            self.assertEqual(entries.count(), 3)
+            self.assertEqual(entries.first().post, post)
+
+    def test_follow_backfills_and_unfollow_clears(self):
+        """Подписка добавляет старые посты автора, отписка убирает их."""
+        post = Post.objects.create(text='Тестовый текст', author=self.author)
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.timeline(), [post.pk])
+        follow.delete()
+        self.assertEqual(self.timeline(), [])
+
+    def test_rebuild_timelines_command(self):
+        """Команда rebuild_timelines восстанавливает ленту."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(text='Тестовый текст', author=self.author)
+        Timeline.objects.all().delete()
+        call_command(
+            'rebuild_timelines', self.reader.username, stdout=StringIO()
+        )
+        self.assertEqual(self.timeline(), [post.pk])
+
+
+@override_settings(POSTS_FANOUT_THRESHOLD=1)
+class FanOutOnReadTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author1 = User.objects.create_user(username='ТестАвтор1')
+        cls.author2 = User.objects.create_user(username='ТестАвтор2')
+        cls.reader = User.objects.create_user(username='ТестЧитатель')
+        Follow.objects.create(user=cls.reader, author=cls.author1)
+        Follow.objects.create(user=cls.reader, author=cls.author2)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.reader)
+
+    def test_heavy_authors_are_merged_on_read(self):
+        """Посты популярных авторов не раскладываются по лентам,
+        а сливаются при чтении в правильном порядке."""
+        for i in range(6):
+            Post.objects.create(text=f'Текст{i}', author=self.author1)
+            Post.objects.create(text=f'Текст{i}', author=self.author2)
+        self.assertFalse(Timeline.objects.exists())
+        expected = list(Post.objects.order_by('-created', '-pk'))
+        url = reverse('posts:follow_index')
+        first_page = self.authorized_client.get(url).context['page_obj']
+        second_page = self.authorized_client.get(
+            url + '?after=' + first_page.next_cursor
+        ).context['page_obj']
+        self.assertEqual(list(first_page) + list(second_page), expected)
+
+    @override_settings(POSTS_AUTHOR_RECENT_LENGTH=3)
+    def test_merged_feed_pages_past_recent_cache(self):
+        """Страницы глубже кэша последних постов дочитываются из базы,
+        а листание назад и ?page= ведут на те же страницы."""
+        for i in range(8):
+            Post.objects.create(text=f'Текст{i}', author=self.author1)
+            Post.objects.create(text=f'Текст{i}', author=self.author2)
+        expected = list(Post.objects.order_by('-created', '-pk'))
+        url = reverse('posts:follow_index')
+        first_page = self.authorized_client.get(url).context['page_obj']
+        second_page = self.authorized_client.get(
+            url + '?after=' + first_page.next_cursor
+        ).context['page_obj']
+        self.assertEqual(list(first_page) + list(second_page), expected)
+        self.assertFalse(second_page.has_next())
+        back = self.authorized_client.get(
+            url + '?before=' + second_page.previous_cursor
+        ).context['page_obj']
+        self.assertEqual(list(back), list(first_page))
+        numbered = self.authorized_client.get(
+            url + '?page=2'
+        ).context['page_obj']
+        self.assertEqual(list(numbered), list(second_page))
+
+    def test_deleted_post_leaves_merged_feed(self):
+        """Удаленный пост пропадает из кэша последних постов автора."""
+        post = Post.objects.create(text='Текст', author=self.author1)
+        url = reverse('posts:follow_index')
+        response = self.authorized_client.get(url)
+        self.assertIn(post, response.context['page_obj'])
+        post.delete()
+        response = self.authorized_client.get(url)
+        self.assertNotIn(post, response.context['page_obj'])
+
+
+@override_settings(POSTS_FANOUT_THRESHOLD=2, POSTS_TIMELINE_LENGTH=3)
+class FanOutThresholdTests(TestCase):
+    def test_posts_reach_timelines_when_author_stops_being_heavy(self):
+        """Посты, вышедшие, пока автор был популярным, попадают в ленты
+        подписчиков, когда подписчиков становится меньше порога."""
+        author = User.objects.create_user(username='ТестАвтор')
+        reader = User.objects.create_user(username='ТестЧитатель')
+        other = User.objects.create_user(username='ТестДругой')
+        Follow.objects.create(user=other, author=author)
+        posts = [
+            Post.objects.create(text=f'Текст{i}', author=author)
+            for i in range(2)
+        ]
+        Follow.objects.create(user=reader, author=author)
+        posts += [
+            Post.objects.create(text=f'Текст{i}', author=author)
+            for i in range(2, 5)
+        ]
+        self.assertFalse(Timeline.objects.filter(user=reader).exists())
+        Follow.objects.filter(user=other).delete()
+        self.assertEqual(
+            list(
+                Timeline.objects.filter(user=reader)
+                .values_list('post_id', flat=True)
+            ),
+            [post.pk for post in posts[:-4:-1]],
+        )
+        client = Client()
+        client.force_login(reader)
+        response = client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']), posts[:-4:-1])
@@ -37,6 +37,7 @@ class PostURLTests(TestCase):
             '/': HTTPStatus.OK,
             f'/group/{self.group.slug}/': HTTPStatus.OK,
             f'/profile/{self.user.username}/': HTTPStatus.OK,
+            '/search/?q=текст': HTTPStatus.OK,
             f'/posts/{self.post.id}/': HTTPStatus.OK,
             '/unexisting_page/': HTTPStatus.NOT_FOUND,
         }
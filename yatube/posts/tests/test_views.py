@@ -1,16 +1,25 @@
 import shutil
 import tempfile
+from unittest import mock
 
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.conf import settings
+from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.core.cache import cache
+from django.core.cache import cache, caches
 from django import forms
 
-from ..models import Post, Group, Follow
+from core.cache.tiered import TieredCache
+from core.storage import HashedStorage
+
+from ..models import Comment, Post, Group, Follow
 from ..forms import PostForm
+from ..cache import get_cache_stats
+from ..funcs import COMMENTS, ELLIPSIS, REPLIES, CachedPaginator
 
 User = get_user_model()
 
@@ -25,6 +34,9 @@ SMALL_GIF = (
     b'\x02\x00\x01\x00\x00\x02\x02\x0C'
     b'\x0A\x00\x3B'
 )
+SMALL_GIF_NAME = HashedStorage().hashed_name(
+    'posts/small.gif', ContentFile(SMALL_GIF)
+)
 UPLOADED = SimpleUploadedFile(
     name='small.gif',
     content=SMALL_GIF,
@@ -113,7 +125,7 @@ class PostPagesTests(TestCase):
                     self.assertEqual(post_text_0, 'Тестовый текст')
                     self.assertEqual(post_author_0, 'ТестАвтор')
                     self.assertEqual(post_group_0, 'Тест-группа')
-                    self.assertEqual(post_image_0, 'posts/small.gif')
+                    self.assertEqual(post_image_0, SMALL_GIF_NAME)
 
     def test_post_detail_page_show_correct_context(self):
         """Шаблон post_detail сформирован с правильным контекстом."""
@@ -132,7 +144,7 @@ class PostPagesTests(TestCase):
             response.context.get('post').group.title, 'Тест-группа'
         )
         self.assertEqual(
-            response.context.get('post').image, 'posts/small.gif'
+            response.context.get('post').image, SMALL_GIF_NAME
         )
 
     def test_create_page_show_correct_context(self):
@@ -264,6 +276,210 @@ class PaginatorViewsTest(TestCase):
                     len(response.context['page_obj']), num_posts
                 )
 
+    def test_cursor_pages(self):
+        """Листание по курсору ?after= / ?before= без пропусков."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'test-slug'}),
+            reverse('posts:profile', kwargs={'username': 'ТестАвтор'}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                cache.clear()
+                first_page = self.client.get(url).context['page_obj']
+                second_page = self.client.get(
+                    url + '?after=' + first_page.next_cursor
+                ).context['page_obj']
+                self.assertTrue(second_page.is_cursor)
+                self.assertEqual(
+                    list(first_page) + list(second_page),
+                    list(Post.objects.order_by('-created', '-pk')),
+                )
+                self.assertFalse(second_page.has_next())
+                back_page = self.client.get(
+                    url + '?before=' + second_page.previous_cursor
+                ).context['page_obj']
+                self.assertEqual(list(back_page), list(first_page))
+                self.assertFalse(back_page.has_previous())
+
+    def test_elided_page_range(self):
+        """Ссылки выводятся только для краев и соседей текущей страницы."""
+        paginator = CachedPaginator(range(1000), 10)
+        self.assertEqual(
+            paginator.get_elided_page_range(50),
+            [1, ELLIPSIS, 48, 49, 50, 51, 52, ELLIPSIS, 100],
+        )
+        self.assertEqual(
+            paginator.get_elided_page_range(2),
+            [1, 2, 3, 4, ELLIPSIS, 100],
+        )
+
+    def test_count_is_cached(self):
+        """Число постов считается один раз на поколение ленты: повторные
+        страницы берут его из кэша, новый пост его сбрасывает."""
+        url = reverse('posts:group_list', kwargs={'slug': 'test-slug'})
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'page': 2})
+        self.assertEqual(response.context['page_obj'].paginator.count, 11)
+        self.assertFalse([
+            query for query in queries if 'COUNT(' in query['sql']
+        ])
+        Post.objects.create(
+            text='Еще пост', author=self.user, group=self.group
+        )
+        response = self.client.get(url, {'page': 2})
+        self.assertEqual(response.context['page_obj'].paginator.count, 12)
+
+    def test_broken_cursor_falls_back_to_first_page(self):
+        """Испорченный курсор отдает первую страницу."""
+        response = self.client.get(reverse('posts:index') + '?after=zzz')
+        self.assertEqual(
+            len(response.context['page_obj']), NUM_PAGINATOR_POSTS_1
+        )
+
+
+class CommentPagesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='ТестАвтор')
+        cls.post = Post.objects.create(text='Тестовый текст', author=cls.user)
+        cls.comments = Comment.objects.bulk_create(
+            Comment(post=cls.post, author=cls.user, text=f'Комментарий {i}')
+            for i in range(COMMENTS + 5)
+        )
+
+    def test_comments_paginated_by_cursor(self):
+        """На странице поста первая страница комментариев, остальные
+        отдает фрагмент по курсору."""
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        )
+        comments = response.context['comments']
+        self.assertEqual(len(comments), COMMENTS)
+        self.assertTrue(comments.has_next())
+        url = reverse('posts:post_comments', kwargs={'post_id': self.post.pk})
+        response = self.client.get(url, {'after': comments.next_cursor})
+        self.assertEqual(
+            [comment.text for comment in response.context['comments']],
+            [f'Комментарий {i}' for i in range(COMMENTS, COMMENTS + 5)],
+        )
+        self.assertNotContains(response, 'Показать еще')
+
+    def test_comment_fragment_queries_bounded(self):
+        """Авторы загружаются тем же запросом, что и комментарии,
+        а первые ответы всех веток — еще одним."""
+        url = reverse('posts:post_comments', kwargs={'post_id': self.post.pk})
+        with self.assertNumQueries(3):
+            self.client.get(url)
+
+    def test_replies(self):
+        """Ответ попадает в ветку, лишние ответы отдает фрагмент ветки."""
+        client = Client()
+        client.force_login(self.user)
+        root = self.post.comments.order_by('created', 'pk').first()
+        for i in range(REPLIES + 2):
+            client.post(
+                reverse('posts:add_comment', kwargs={'post_id': self.post.pk}),
+                {'text': f'Ответ {i}', 'parent': root.pk},
+            )
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        )
+        thread = response.context['comments'][0]
+        self.assertEqual(
+            [reply.text for reply in thread.shown_replies],
+            [f'Ответ {i}' for i in range(REPLIES)],
+        )
+        self.assertEqual(thread.hidden_replies, 2)
+        response = self.client.get(
+            reverse('posts:comment_replies', kwargs={
+                'post_id': self.post.pk, 'comment_id': root.pk,
+            }),
+            {'after': thread.shown_replies[-1].path},
+        )
+        self.assertEqual(
+            [reply.text for reply in response.context['replies']],
+            [f'Ответ {i}' for i in range(REPLIES, REPLIES + 2)],
+        )
+
+
+class FeedQueriesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='Читатель')
+        cls.group = Group.objects.create(title='Группа', slug='group')
+        cls.authors = [
+            User.objects.create_user(username=f'Автор{i}') for i in range(3)
+        ]
+        for author in cls.authors:
+            Follow.objects.create(user=cls.reader, author=author)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.reader)
+
+    def add_posts(self, count):
+        for i in range(count):
+            Post.objects.create(
+                text=f'Пост {i}',
+                author=self.authors[i % len(self.authors)],
+                group=self.group,
+            )
+
+    def feed_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        return [query['sql'] for query in queries.captured_queries]
+
+    def test_feeds_cost_fixed_queries(self):
+        """Число запросов ленты не растет с числом постов на странице,
+        а из auth_user не читается хэш пароля."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': 'Автор0'}),
+            reverse('posts:follow_index'),
+        )
+        self.add_posts(2)
+        few = {url: len(self.feed_queries(url)) for url in urls}
+        self.add_posts(NUM_PAGINATOR_POSTS_1 * 2)
+        for url in urls:
+            with self.subTest(url=url):
+                queries = self.feed_queries(url)
+                self.assertEqual(len(queries), few[url])
+                for sql in queries:
+                    if 'posts_post' in sql:
+                        self.assertNotIn('password', sql)
+
+    @override_settings(
+        CORE_REPEATED_QUERIES='raise', CORE_REPEATED_QUERIES_THRESHOLD=3
+    )
+    def test_pages_have_no_repeated_queries(self):
+        """Ни лента, ни страница поста с ветками комментариев
+        не загружают связанные объекты в цикле."""
+        self.add_posts(NUM_PAGINATOR_POSTS_1)
+        post = Post.objects.first()
+        for author in self.authors:
+            root = Comment.objects.create(post=post, author=author, text='К')
+            Comment.objects.create(
+                post=post, author=author, text='О', parent=root
+            )
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': 'Автор0'}),
+            reverse('posts:follow_index'),
+            reverse('posts:post_detail', kwargs={'post_id': post.pk}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                cache.clear()
+                self.assertEqual(self.client.get(url).status_code, 200)
+
 
 class CacheViewsTest(TestCase):
     @classmethod
@@ -283,13 +499,140 @@ class CacheViewsTest(TestCase):
     def test_cache_index_page(self):
         """Страница index попадает в кэш."""
         response1 = self.authorized_client.get(reverse('posts:index'))
-        self.post.delete()
+        # Изменение в обход модели не сбрасывает кэш.
+        Post.objects.filter(pk=self.post.pk).update(text='Новый текст')
         response2 = self.authorized_client.get(reverse('posts:index'))
         self.assertEqual(response1.content, response2.content)
         cache.clear()
         response3 = self.authorized_client.get(reverse('posts:index'))
         self.assertNotEqual(response1.content, response3.content)
 
+    def test_post_changes_invalidate_cached_pages(self):
+        """Создание, правка и удаление поста сбрасывают кэш лент."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:profile', kwargs={'username': 'ТестАвтор'}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                self.authorized_client.get(url)
+                post = Post.objects.create(
+                    text='Свежий пост', author=self.user
+                )
+                response = self.authorized_client.get(url)
+                self.assertIn(post, response.context['page_obj'])
+                post.text = 'Исправленный пост'
+                post.save()
+                response = self.authorized_client.get(url)
+                self.assertContains(response, 'Исправленный пост')
+                post.delete()
+                response = self.authorized_client.get(url)
+                self.assertNotContains(response, 'Исправленный пост')
+
+    @override_settings(POSTS_PAGE_CACHE_SOFT_TIMEOUT=-1)
+    def test_stale_page_served_while_locked(self):
+        """Пока страницу пересобирает другой запрос, отдается старая копия,
+        после снятия блокировки страница пересобирается."""
+        url = reverse('posts:index')
+        self.authorized_client.get(url)
+        # bulk_create не шлет сигналов, и поколение ленты не меняется.
+        Post.objects.bulk_create(
+            [Post(text='Новый текст', author=self.user)]
+        )
+        shared = caches['shared']
+        add = shared.add
+
+        def locked_add(key, *args, **kwargs):
+            if key.endswith(':lock'):
+                return False
+            return add(key, *args, **kwargs)
+
+        with mock.patch.object(shared, 'add', side_effect=locked_add):
+            response = self.authorized_client.get(url)
+        self.assertNotContains(response, 'Новый текст')
+        self.assertEqual(get_cache_stats()['stale'], 1)
+        response = self.authorized_client.get(url)
+        self.assertContains(response, 'Новый текст')
+        self.assertEqual(get_cache_stats()['regeneration'], 2)
+
+    def test_page_key_ignores_extra_parameters(self):
+        """Неверный номер страницы и посторонние параметры не создают
+        новых записей в кэше лент."""
+        url = reverse('posts:index')
+        for params in ({}, {'page': 'abc'}, {'page': '9999'},
+                       {'page': '1', 'utm_source': 'x'}, {'after': '!'}):
+            with self.subTest(params=params):
+                response = self.authorized_client.get(url, params)
+                self.assertContains(response, self.post.text)
+        stats = get_cache_stats()
+        self.assertEqual(stats['regeneration'], 1)
+        self.assertEqual(stats['hit'], 4)
+
+    def test_regeneration_keeps_memory_cache(self):
+        """Поколения и блокировки пересборки не сбрасывают записи
+        в памяти процессов: штамп корзины повышает лишь новый список."""
+        url = reverse('posts:index')
+        self.authorized_client.get(url)
+        with mock.patch.object(
+            TieredCache, '_bump', autospec=True
+        ) as bump:
+            Post.objects.create(text='Свежий пост', author=self.user)
+            self.authorized_client.get(url)
+        keys = [key for call in bump.call_args_list for key in call[0][1]]
+        self.assertTrue(keys)
+        self.assertFalse([
+            key for key in keys
+            if 'generation' in key or key.endswith(':lock')
+        ])
+
+    def test_post_edit_keeps_cached_id_list(self):
+        """Правка поста сбрасывает только его объект, а не списки лент."""
+        url = reverse('posts:index')
+        self.authorized_client.get(url)
+        post = Post.objects.get(pk=self.post.pk)
+        post.text = 'Исправленный текст'
+        post.save()
+        response = self.authorized_client.get(url)
+        self.assertContains(response, 'Исправленный текст')
+        stats = get_cache_stats()
+        self.assertEqual(stats['regeneration'], 1)
+        self.assertEqual(stats['hit'], 1)
+
+    def test_author_and_group_changes_reach_cached_posts(self):
+        """Правка автора и удаление группы видны в закэшированных
+        постах."""
+        group = Group.objects.create(title='Группа', slug='group')
+        self.post.group = group
+        self.post.save()
+        url = reverse('posts:index')
+        self.assertContains(self.authorized_client.get(url), '/group/group/')
+        self.user.first_name = 'Переименованный'
+        self.user.save()
+        self.assertContains(
+            self.authorized_client.get(url), 'Переименованный'
+        )
+        group.slug = 'renamed'
+        group.save()
+        self.assertContains(
+            self.authorized_client.get(url), '/group/renamed/'
+        )
+        group.delete()
+        self.assertNotContains(
+            self.authorized_client.get(url), '/group/renamed/'
+        )
+
+    def test_group_change_invalidates_old_group(self):
+        """Пост, перенесенный в другую группу, пропадает из старой."""
+        group = Group.objects.create(title='Группа', slug='group')
+        other = Group.objects.create(title='Другая', slug='other')
+        self.post.group = group
+        self.post.save()
+        url = reverse('posts:group_list', kwargs={'slug': 'group'})
+        self.assertContains(self.authorized_client.get(url), 'Тестовый')
+        self.post.group = other
+        self.post.save()
+        self.assertNotContains(self.authorized_client.get(url), 'Тестовый')
+
 
 class FollowingViewsTest(TestCase):
     @classmethod
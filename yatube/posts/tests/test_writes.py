@@ -0,0 +1,83 @@
+import threading
+from concurrent.futures import Future
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import (
+    Client, TestCase, TransactionTestCase, override_settings,
+)
+from django.urls import reverse
+
+from ..models import Comment, Follow, Post
+from ..writes import commit_batch, get_write_stats, run_write
+
+User = get_user_model()
+
+
+class CommitBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='ТестАвтор')
+        cls.reader = User.objects.create_user(username='ТестЧитатель')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_failed_write_does_not_break_batch(self):
+        """Ошибка одной записи откатывает только ее."""
+        def follow():
+            return Follow.objects.create(user=self.reader, author=self.author)
+
+        batch = [(follow, Future()), (follow, Future())]
+        commit_batch(batch)
+        self.assertEqual(batch[0][1].result().author, self.author)
+        self.assertIsInstance(batch[1][1].exception(), IntegrityError)
+        self.assertEqual(Follow.objects.count(), 1)
+        stats = get_write_stats()
+        self.assertEqual((stats['batches'], stats['writes']), (1, 2))
+        out = StringIO()
+        call_command('write_stats', stdout=out)
+        self.assertIn('средний пакет: 2.0 записей', out.getvalue())
+
+
+@override_settings(POSTS_WRITE_COALESCING=True, POSTS_WRITE_BATCH_WAIT=0.5)
+class WriteCoalescingTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='ТестАвтор')
+        self.post = Post.objects.create(
+            text='Тестовый текст', author=self.author
+        )
+
+    def test_redirect_shows_own_comment(self):
+        """Запрос ждет фиксации пакета и видит свой комментарий."""
+        client = Client()
+        client.force_login(self.author)
+        response = client.post(
+            reverse('posts:add_comment', kwargs={'post_id': self.post.pk}),
+            {'text': 'Свой комментарий'},
+            follow=True,
+        )
+        self.assertContains(response, 'Свой комментарий')
+
+    def test_concurrent_writes_share_transaction(self):
+        """Записи параллельных запросов фиксируются одним пакетом."""
+        def comment(i):
+            run_write(lambda: Comment.objects.create(
+                post=self.post, author=self.author, text=f'Комментарий {i}'
+            ))
+
+        threads = [
+            threading.Thread(target=comment, args=(i,)) for i in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.post.comments.count(), 5)
+        stats = get_write_stats()
+        self.assertEqual(stats['writes'], 5)
+        self.assertLess(stats['batches'], 5)
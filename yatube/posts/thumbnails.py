@@ -0,0 +1,220 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from PIL import Image
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.models import KVStore
+
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_pending = {}
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.POSTS_THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails',
+            )
+        return _executor
+
+
+def thumbnail_variants(source_width=None):
+    """Все варианты миниатюры: (формат, ширина, геометрия, опции).
+
+    Ширины берутся из POSTS_THUMBNAIL_WIDTHS, высота — по пропорциям
+    POSTS_THUMBNAIL_SIZE. Если известна ширина исходника, ширины больше
+    нее не нужны: от увеличения картинка четче не станет. Форматы,
+    которые Pillow не умеет сохранять (например, WebP без libwebp),
+    пропускаются.
+    """
+    Image.init()
+    width, height = settings.POSTS_THUMBNAIL_SIZE
+    widths = sorted(settings.POSTS_THUMBNAIL_WIDTHS)
+    if source_width:
+        widths = widths[:1] + [
+            variant_width for variant_width in widths[1:]
+            if variant_width <= source_width
+        ]
+    return [
+        (
+            image_format, variant_width,
+            f'{variant_width}x{round(variant_width * height / width)}',
+            {'crop': 'center', 'upscale': True, 'format': image_format},
+        )
+        for image_format in settings.POSTS_THUMBNAIL_FORMATS
+        if image_format in Image.SAVE
+        for variant_width in widths
+    ]
+
+
+def _thumbnail_options(source, options):
+    # Те же умолчания, что подставляет ThumbnailBackend.get_thumbnail:
+    # без них имя миниатюры не совпадет с тем, под которым она создана.
+    options = dict(options)
+    if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', default.backend._get_format(source))
+    for key, value in default.backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in default.backend.extra_options:
+        value = getattr(thumbnail_settings, attr)
+        if value != getattr(default_settings, attr):
+            options.setdefault(key, value)
+    return options
+
+
+def _thumbnail_file(image, geometry, options):
+    source = ImageFile(image)
+    name = default.backend._get_thumbnail_filename(
+        source, geometry, _thumbnail_options(source, options)
+    )
+    return ImageFile(name, default.storage)
+
+
+def prefetch_thumbnails(posts):
+    """Загружает записи sorl о миниатюрах всех постов страницы.
+
+    Все варианты из thumbnail_variants читаются одним get_many из кэша
+    хранилища sorl, недостающие — одним запросом к его таблице.
+    Найденное запоминается у post.image, и ready_thumbnail для этих
+    изображений больше не обращается ни к кэшу, ни к базе.
+    """
+    wanted = {}
+    for post in posts:
+        if not post.image:
+            continue
+        post.image._thumbnails = {}
+        variants = thumbnail_variants(post.image_width)
+        for _, _, geometry, options in variants:
+            thumbnail = _thumbnail_file(post.image, geometry, options)
+            wanted.setdefault(add_prefix(thumbnail.key), []).append(
+                (post.image, thumbnail.name)
+            )
+    if not wanted:
+        return
+    kv_cache = default.kvstore.cache
+    found = kv_cache.get_many(wanted)
+    missing = [key for key in wanted if key not in found]
+    if missing:
+        stored = dict(
+            KVStore.objects.filter(key__in=missing).values_list('key', 'value')
+        )
+        # Как и sorl, запоминаем в кэше и отсутствие записи.
+        stored.update(
+            (key, EMPTY_VALUE) for key in missing if key not in stored
+        )
+        kv_cache.set_many(stored, thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT)
+        found.update(stored)
+    for key, images in wanted.items():
+        value = found[key]
+        thumbnail = (
+            deserialize_image_file(value)
+            if value and value != EMPTY_VALUE else None
+        )
+        for image, name in images:
+            image._thumbnails[name] = thumbnail
+
+
+def ready_thumbnail(image, geometry, **options):
+    """Готовая миниатюра из хранилища sorl или None.
+
+    В отличие от get_thumbnail, никогда не открывает исходное
+    изображение: отсутствующую миниатюру только ставит в очередь.
+    """
+    if not image:
+        return None
+    thumbnail_file = _thumbnail_file(image, geometry, options)
+    prefetched = getattr(image, '_thumbnails', {})
+    if thumbnail_file.name in prefetched:
+        thumbnail = prefetched[thumbnail_file.name]
+    else:
+        thumbnail = default.kvstore.get(thumbnail_file)
+    if thumbnail is None:
+        schedule_thumbnails(image.name, _source_width(image))
+    return thumbnail
+
+
+def _source_width(image):
+    return getattr(getattr(image, 'instance', None), 'image_width', None)
+
+
+def ready_variants(image):
+    """Готовые варианты миниатюры по форматам.
+
+    Возвращает словарь {формат: [(ширина, миниатюра), ...]} по
+    возрастанию ширины; недостающие варианты ставятся в очередь.
+    """
+    variants = {}
+    for image_format, width, geometry, options in thumbnail_variants(
+        _source_width(image)
+    ):
+        thumbnail = ready_thumbnail(image, geometry, **options)
+        if thumbnail is not None:
+            variants.setdefault(image_format, []).append((width, thumbnail))
+    return variants
+
+
+def generate_thumbnails(name, source_width=None):
+    """Создает все варианты миниатюры для изображения."""
+    # Хранилище входит в ключ миниатюры sorl, поэтому исходник открываем
+    # тем же хранилищем, что и post.image в шаблонах.
+    source = ImageFile(name, Post._meta.get_field('image').storage)
+    for _, _, geometry, options in thumbnail_variants(source_width):
+        try:
+            get_thumbnail(source, geometry, **options)
+        except Exception:
+            logger.exception('Не удалось создать миниатюру %s для %s',
+                             geometry, name)
+
+
+def _run(name, source_width):
+    try:
+        generate_thumbnails(name, source_width)
+    finally:
+        with _lock:
+            _pending.pop(name, None)
+        # Поток пула держит собственное соединение с базой.
+        close_old_connections()
+
+
+def schedule_thumbnails(name, source_width=None):
+    """Ставит создание миниатюр в пул после фиксации транзакции.
+
+    Повторные вызовы для изображения, которое уже в очереди,
+    ничего не делают. При POSTS_THUMBNAIL_WORKERS = 0 миниатюры
+    создаются сразу в текущем потоке.
+    """
+    if not name:
+        return
+
+    def submit():
+        if not settings.POSTS_THUMBNAIL_WORKERS:
+            generate_thumbnails(name, source_width)
+            return
+        executor = _get_executor()
+        with _lock:
+            if name not in _pending:
+                _pending[name] = executor.submit(_run, name, source_width)
+
+    transaction.on_commit(submit)
+
+
+def wait_for_thumbnails():
+    """Дожидается миниатюр, уже поставленных в пул."""
+    with _lock:
+        futures = list(_pending.values())
+    wait(futures)
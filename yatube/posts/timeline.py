@@ -0,0 +1,331 @@
+import heapq
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from .funcs import PAGES, CursorPage, decode_cursor, get_page_object
+from .models import Follow, Post, Timeline, UserCounters
+
+RECENT_POSTS_KEY = 'posts:recent:{}'
+
+
+def heavy_author_ids(author_ids):
+    """Авторы, у которых подписчиков не меньше POSTS_FANOUT_THRESHOLD.
+
+    Их посты не раскладываются по лентам, а подмешиваются при чтении.
+    """
+    return set(
+        UserCounters.objects
+        .filter(
+            user_id__in=author_ids,
+            followers_count__gte=settings.POSTS_FANOUT_THRESHOLD,
+        )
+        .values_list('user_id', flat=True)
+    )
+
+
+def trim_timelines(user_ids):
+    """Оставляет в лентах пользователей user_ids не больше
+    TIMELINE_LENGTH записей.
+
+    Все ленты обрезаются одним DELETE: номер записи в ленте считает
+    ROW_NUMBER() по индексу (user, created, post). user_ids может быть
+    подзапросом, например подписчиками автора.
+    """
+    ranked = (
+        Timeline.objects
+        .filter(user_id__in=user_ids)
+        .annotate(position=Window(
+            RowNumber(),
+            partition_by=F('user_id'),
+            order_by=(F('created').desc(), F('post_id').desc()),
+        ))
+        .values('pk', 'position')
+        .order_by()
+    )
+    sql, params = ranked.query.sql_with_params()
+    table = connection.ops.quote_name(Timeline._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE id IN '
+            f'(SELECT id FROM ({sql}) ranked WHERE position > %s)',
+            (*params, settings.POSTS_TIMELINE_LENGTH),
+        )
+
+
+def fan_out_post(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    add_recent_post(post)
+    if heavy_author_ids([post.author_id]):
+        return
+    followers = (
+        Follow.objects
+        .filter(author_id=post.author_id)
+        .values_list('user_id', flat=True)
+    )
+    Timeline.objects.bulk_create(
+        [
+            Timeline(user_id=user_id, post=post, created=post.created)
+            for user_id in followers
+        ],
+        ignore_conflicts=True,
+    )
+    trim_timelines(followers)
+
+
+def backfill_timeline(user_id, author_id):
+    """Добавляет в ленту последние посты автора после подписки на него."""
+    if heavy_author_ids([author_id]):
+        return
+    posts = (
+        Post.objects
+        .filter(author_id=author_id)
+        .values_list('pk', 'created')
+        [:settings.POSTS_TIMELINE_LENGTH]
+    )
+    Timeline.objects.bulk_create(
+        [
+            Timeline(user_id=user_id, post_id=pk, created=created)
+            for pk, created in posts
+        ],
+        ignore_conflicts=True,
+    )
+    trim_timelines([user_id])
+
+
+def fan_out_author(author_id):
+    """Раскладывает последние посты автора по лентам всех подписчиков.
+
+    Пока у автора было не меньше POSTS_FANOUT_THRESHOLD подписчиков,
+    его новые посты и новые подписки на него в ленты не попадали.
+    Когда он перестает быть популярным, ленты дополняются одним
+    INSERT ... SELECT и обрезаются одним DELETE.
+    """
+    followers = Follow.objects.filter(author_id=author_id).values('user_id')
+    posts = (
+        Post.objects
+        .filter(author_id=author_id)
+        .order_by('-created', '-pk')
+        .values('pk', 'created')
+        [:settings.POSTS_TIMELINE_LENGTH]
+    )
+    followers_sql, followers_params = followers.query.sql_with_params()
+    posts_sql, posts_params = posts.query.sql_with_params()
+    ops = connection.ops
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'{ops.insert_statement(ignore_conflicts=True)} '
+            f'{ops.quote_name(Timeline._meta.db_table)} '
+            f'(user_id, post_id, created) '
+            f'SELECT followers.user_id, posts.id, posts.created '
+            f'FROM ({followers_sql}) followers, ({posts_sql}) posts '
+            f'{ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}',
+            (*followers_params, *posts_params),
+        )
+    trim_timelines(followers.values_list('user_id', flat=True))
+
+
+def author_unfollowed(author_id):
+    """Дополняет ленты подписчиков, если автор перестал быть
+    популярным."""
+    followers_count = (
+        UserCounters.objects
+        .filter(user_id=author_id)
+        .values_list('followers_count', flat=True)
+        .first()
+    )
+    if followers_count == settings.POSTS_FANOUT_THRESHOLD - 1:
+        fan_out_author(author_id)
+
+
+def remove_from_timeline(user_id, author_id):
+    """Убирает из ленты посты автора после отписки от него."""
+    Timeline.objects.filter(
+        user_id=user_id,
+        post__author_id=author_id,
+    ).delete()
+
+
+def rebuild_timeline(user_id):
+    """Собирает ленту пользователя заново по его подпискам."""
+    Timeline.objects.filter(user_id=user_id).delete()
+    posts = (
+        Post.objects
+        .filter(author__following__user_id=user_id)
+        .values_list('pk', 'created')
+        [:settings.POSTS_TIMELINE_LENGTH]
+    )
+    Timeline.objects.bulk_create(
+        [
+            Timeline(user_id=user_id, post_id=pk, created=created)
+            for pk, created in posts
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def recent_posts(author_id):
+    """Ключи (created, id) последних постов автора, от новых к старым."""
+    key = RECENT_POSTS_KEY.format(author_id)
+    entries = cache.get(key)
+    if entries is None:
+        # Список живет в общем кэше, поэтому читается из основной базы.
+        entries = list(
+            Post.objects
+            .using(DEFAULT_DB_ALIAS)
+            .filter(author_id=author_id)
+            .order_by('-created', '-pk')
+            .values_list('created', 'pk')
+            [:settings.POSTS_AUTHOR_RECENT_LENGTH]
+        )
+        cache.set(key, entries, settings.POSTS_AUTHOR_RECENT_TIMEOUT)
+    return entries
+
+
+def add_recent_post(post):
+    key = RECENT_POSTS_KEY.format(post.author_id)
+    entries = cache.get(key)
+    if entries is None:
+        return
+    entries = sorted(entries + [(post.created, post.pk)], reverse=True)
+    cache.set(
+        key,
+        entries[:settings.POSTS_AUTHOR_RECENT_LENGTH],
+        settings.POSTS_AUTHOR_RECENT_TIMEOUT,
+    )
+
+
+def forget_recent_posts(author_id):
+    cache.delete(RECENT_POSTS_KEY.format(author_id))
+
+
+def keyset(queryset, key, bound, newer, limit):
+    """Первые limit ключей queryset по полям key после bound: к более
+    старым или, при newer, к более новым."""
+    created_field, pk_field = key
+    lookup = 'gt' if newer else 'lt'
+    if bound is not None:
+        created, pk = bound
+        queryset = queryset.filter(
+            Q(**{f'{created_field}__{lookup}': created})
+            | Q(**{created_field: created, f'{pk_field}__{lookup}': pk})
+        )
+    order = '' if newer else '-'
+    return list(
+        queryset
+        .order_by(f'{order}{created_field}', f'{order}{pk_field}')
+        .values_list(created_field, pk_field)[:limit]
+    )
+
+
+def author_keys(author_id, bound, newer, limit):
+    """Ключи постов популярного автора для слияния в ленту.
+
+    Берутся из кэша последних постов; если страница уходит глубже
+    POSTS_AUTHOR_RECENT_LENGTH закэшированных постов, — из базы.
+    """
+    entries = recent_posts(author_id)
+    if newer:
+        keys = [key for key in reversed(entries) if key > bound]
+    else:
+        keys = [key for key in entries if bound is None or key < bound]
+    complete = len(entries) < settings.POSTS_AUTHOR_RECENT_LENGTH or (
+        len(keys) >= limit and not (newer and bound < entries[-1])
+    )
+    if complete:
+        return keys[:limit]
+    return keyset(
+        Post.objects.filter(author_id=author_id),
+        ('created', 'pk'), bound, newer, limit,
+    )
+
+
+def merged_feed_keys(user_id, heavy_ids, bound=None, newer=False,
+                     limit=PAGES + 1):
+    """Первые limit ключей ленты подписок после bound (при newer — до
+    него, от старых к новым): материализованная лента плюс посты
+    популярных авторов, слитые по (created, id) через кучу.
+
+    Каждый поток уже ограничен курсором и limit, поэтому запрос читает
+    порядка limit ключей на поток, а не всю ленту.
+    """
+    streams = [
+        author_keys(author_id, bound, newer, limit) for author_id in heavy_ids
+    ]
+    streams.append(keyset(
+        Timeline.objects.filter(user_id=user_id),
+        ('created', 'post_id'), bound, newer, limit,
+    ))
+    keys = []
+    for key in heapq.merge(*streams, reverse=not newer):
+        # Пост мог попасть в ленту до того, как автор стал популярным.
+        if keys and keys[-1] == key:
+            continue
+        keys.append(key)
+        if len(keys) == limit:
+            break
+    return keys
+
+
+def hydrate_posts(keys):
+    posts = Post.objects.for_feed().in_bulk([pk for _, pk in keys])
+    return [posts[pk] for _, pk in keys if pk in posts]
+
+
+def get_follow_page(request):
+    """Страница ленты подписок пользователя."""
+    user = request.user
+    heavy_ids = heavy_author_ids(
+        Follow.objects.filter(user=user).values_list('author_id', flat=True)
+    )
+    if not heavy_ids:
+        # Сортируем по копии ключа в Timeline, чтобы читать страницу
+        # прямо из индекса (user, created, post). Аннотации повторно
+        # используют join из filter(); фильтр по timeline_entries__created
+        # добавил бы к запросу второй join.
+        post_list = (
+            Post.objects
+            .filter(timeline_entries__user=user)
+            .annotate(
+                entry_created=F('timeline_entries__created'),
+                entry_post=F('timeline_entries__post'),
+            )
+            .for_feed()
+        )
+        return get_page_object(
+            request, post_list, key=('entry_created', 'entry_post')
+        )
+    return get_merged_page(request, user.pk, heavy_ids)
+
+
+def get_merged_page(request, user_id, heavy_ids):
+    """Страница ленты подписок со слиянием постов популярных авторов.
+
+    Листается только по курсору; ?page=N отдает страницу со сдвигом
+    (N - 1) * PAGES от начала ленты.
+    """
+    after = decode_cursor(request.GET.get('after', ''))
+    before = decode_cursor(request.GET.get('before', ''))
+    if before is not None:
+        keys = merged_feed_keys(user_id, heavy_ids, before, newer=True)
+        return CursorPage(
+            hydrate_posts(keys[:PAGES][::-1]),
+            has_next=True,
+            has_previous=len(keys) > PAGES,
+        )
+    offset = 0
+    if after is None:
+        page = request.GET.get('page', '')
+        if page.isdigit() and int(page) > 1:
+            offset = (int(page) - 1) * PAGES
+    keys = merged_feed_keys(
+        user_id, heavy_ids, after, limit=offset + PAGES + 1
+    )
+    return CursorPage(
+        hydrate_posts(keys[offset:offset + PAGES]),
+        has_next=len(keys) > offset + PAGES,
+        has_previous=after is not None or offset > 0,
+    )
@@ -11,6 +11,8 @@ urlpatterns = [
     path('group/<slug:slug>/', views.group_posts, name='group_list'),
     # Профайл пользователя
     path('profile/<str:username>/', views.profile, name='profile'),
+    # Поиск по постам
+    path('search/', views.search, name='search'),
     # Просмотр записи
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
     # Создание новой записи
@@ -23,6 +25,17 @@ urlpatterns = [
         views.add_comment,
         name='add_comment'
     ),
+    # Страница комментариев для подгрузки
+    path(
+        'posts/<int:post_id>/comments/',
+        views.post_comments,
+        name='post_comments'
+    ),
+    path(
+        'posts/<int:post_id>/comments/<int:comment_id>/',
+        views.comment_replies,
+        name='comment_replies'
+    ),
     # Подписка на авторов
     path('follow/', views.follow_index, name='follow_index'),
     path(
@@ -1,26 +1,45 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.cache import cache_page
 
-from .models import User, Post, Group, Follow
+from core.replicas import replica_reads
+
+from .models import User, Post, Group, Follow, UserCounters, Comment
 from .forms import PostForm, CommentForm
-from .funcs import get_page_object
+from .cache import get_feed_page
+from .funcs import REPLIES, REPLIES_PAGE, decode_cursor, get_comment_page
+from .search import decode_search_cursor, search_posts
+from .thumbnails import prefetch_thumbnails
+from .timeline import get_follow_page
+from .writes import run_write
+
+
+def get_comments(request, post):
+    after = request.GET.get('after')
+    comments = get_comment_page(
+        post.comments.filter(parent=None).select_related('author'),
+        after=decode_cursor(after) if after else None,
+    )
+    Comment.attach_replies(comments, REPLIES)
+    return comments
 
 
-@cache_page(20, key_prefix='index_page')
+@replica_reads
 def index(request):
-    post_list = Post.objects.select_related('author', 'group').all()
-    page_obj = get_page_object(request, post_list)
+    post_list = Post.objects.for_feed()
+    page_obj = get_feed_page(request, 'index', post_list)
+    prefetch_thumbnails(page_obj)
     context = {
         'page_obj': page_obj,
     }
     return render(request, 'posts/index.html', context)
 
 
+@replica_reads
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    page_obj = get_page_object(request, post_list)
+    post_list = Post.objects.filter(group=group).for_feed()
+    page_obj = get_feed_page(request, f'group:{slug}', post_list)
+    prefetch_thumbnails(page_obj)
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -28,15 +47,23 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@replica_reads
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts.all()
-    num_posts = post_list.count()
-    page_obj = get_page_object(request, post_list)
+    author = get_object_or_404(
+        User.objects.select_related('counters'),
+        username=username,
+    )
+    post_list = Post.objects.filter(author=author).for_feed()
+    counters = UserCounters.of(author)
+    page_obj = get_feed_page(
+        request, f'author:{username}', post_list, count=counters.posts_count
+    )
+    prefetch_thumbnails(page_obj)
     context = {
         'author': author,
         'page_obj': page_obj,
-        'num_posts': num_posts,
+        'num_posts': counters.posts_count,
+        'counters': counters,
     }
     if request.user.is_anonymous:
         return render(request, 'posts/profile.html', context)
@@ -50,20 +77,65 @@ def profile(request, username):
     return render(request, 'posts/profile.html', context)
 
 
+@replica_reads
+def search(request):
+    """Поиск по тексту постов, от более релевантных к менее."""
+    query = request.GET.get('q', '').strip()
+    after = decode_search_cursor(request.GET.get('after', ''))
+    page_obj = search_posts(query, after=after)
+    prefetch_thumbnails(page_obj)
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@replica_reads
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    num_posts = post.author.posts.count()
+    post = get_object_or_404(
+        Post.objects.select_related('author__counters', 'group'),
+        id=post_id,
+    )
+    num_posts = UserCounters.of(post.author).posts_count
     form = CommentForm(request.POST or None)
-    comment = post.comments.all()
     context = {
         'post': post,
         'num_posts': num_posts,
         'form': form,
-        'comments': comment,
+        'comments': get_comments(request, post),
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+def post_comments(request, post_id):
+    """Следующая страница комментариев для кнопки «Показать еще»."""
+    post = get_object_or_404(Post, id=post_id)
+    context = {
+        'post': post,
+        'comments': get_comments(request, post),
+    }
+    return render(request, 'posts/includes/comment_list.html', context)
+
+
+def comment_replies(request, post_id, comment_id):
+    """Ответы в ветке под комментарием, страницами по пути в дереве."""
+    comment = get_object_or_404(Comment, post_id=post_id, id=comment_id)
+    replies = comment.subtree().select_related('author')
+    after = request.GET.get('after')
+    if after:
+        replies = replies.filter(path__gt=after)
+    replies = list(replies[:REPLIES_PAGE + 1])
+    context = {
+        'post': comment.post,
+        'comment': comment,
+        'replies': replies[:REPLIES_PAGE],
+        'next_path': replies[REPLIES_PAGE - 1].path
+        if len(replies) > REPLIES_PAGE else None,
+    }
+    return render(request, 'posts/includes/comment_replies.html', context)
+
+
 @login_required
 def post_create(request):
     form = PostForm(
@@ -110,14 +182,18 @@ def add_comment(request, post_id):
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        parent_id = request.POST.get('parent', '')
+        if parent_id.isdigit():
+            comment.parent = post.comments.filter(pk=parent_id).first()
+        run_write(comment.save)
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
+@replica_reads
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    page_obj = get_page_object(request, post_list)
+    page_obj = get_follow_page(request)
+    prefetch_thumbnails(page_obj)
     context = {'page_obj': page_obj}
     return render(request, 'posts/follow.html', context)
 
@@ -127,10 +203,10 @@ def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     user = request.user
     if user != author:
-        Follow.objects.get_or_create(
+        run_write(lambda: Follow.objects.get_or_create(
             user=user,
             author=author,
-        )
+        ))
     return redirect('posts:profile', username=username)
 
 
@@ -139,5 +215,5 @@ def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     user = request.user
     follow_obj = get_object_or_404(Follow, user=user, author=author)
-    follow_obj.delete()
+    run_write(follow_obj.delete)
     return redirect('posts:profile', username=username)
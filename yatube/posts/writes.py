@@ -0,0 +1,124 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from core.cache.counters import Counters
+from core.replicas import note_write
+
+logger = logging.getLogger(__name__)
+
+WRITE_STATS_KEY = 'posts:write_stats:{}'
+WRITE_STATS = ('batches', 'writes', 'failed', 'commit_us')
+
+write_stats = Counters(WRITE_STATS_KEY, WRITE_STATS)
+
+_queue = queue.Queue()
+_writer = None
+_lock = threading.Lock()
+
+
+def get_write_stats():
+    return write_stats.get()
+
+
+def _collect():
+    """Первая запись из очереди и все, что успело прийти за ней.
+
+    Ждет не дольше POSTS_WRITE_BATCH_WAIT и берет не больше
+    POSTS_WRITE_BATCH_SIZE записей.
+    """
+    batch = [_queue.get()]
+    deadline = time.monotonic() + settings.POSTS_WRITE_BATCH_WAIT
+    while len(batch) < settings.POSTS_WRITE_BATCH_SIZE:
+        timeout = deadline - time.monotonic()
+        try:
+            batch.append(
+                _queue.get(timeout=timeout) if timeout > 0
+                else _queue.get_nowait()
+            )
+        except queue.Empty:
+            break
+    return batch
+
+
+def commit_batch(batch):
+    """Выполняет записи batch в одной транзакции.
+
+    Каждая запись идет в своей точке сохранения, так что ошибка одной
+    откатывает только ее. Результаты отдаются ожидающим после фиксации.
+    """
+    results = []
+    started = time.monotonic()
+    try:
+        with transaction.atomic():
+            for write, future in batch:
+                try:
+                    with transaction.atomic():
+                        results.append((future, write(), None))
+                except Exception as error:
+                    results.append((future, None, error))
+    except Exception as error:
+        write_stats.add('failed', len(batch))
+        logger.exception('Не удалось зафиксировать пакет записей')
+        for _, future in batch:
+            future.set_exception(error)
+        return
+    elapsed = time.monotonic() - started
+    write_stats.add('batches', 1)
+    write_stats.add('writes', len(batch))
+    write_stats.add('commit_us', int(elapsed * 1e6))
+    logger.debug('Пакет из %d записей зафиксирован за %.1f мс',
+                 len(batch), elapsed * 1000)
+    for future, result, error in results:
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+
+def _run():
+    while True:
+        batch = _collect()
+        try:
+            commit_batch(batch)
+        finally:
+            close_old_connections()
+
+
+def _get_writer():
+    global _writer
+    with _lock:
+        if _writer is None:
+            _writer = threading.Thread(
+                target=_run, name='posts-writer', daemon=True
+            )
+            _writer.start()
+        return _writer
+
+
+def run_write(write):
+    """Выполняет запись в базу и возвращает ее результат.
+
+    При POSTS_WRITE_COALESCING записи всех запросов процесса выполняет
+    один поток, объединяя их в общие транзакции: SQLite не
+    передает блокировку записи между запросами на каждой записи. Вызов
+    все равно ждет фиксации, поэтому следующий запрос того же
+    пользователя видит свою запись. Внутри открытой транзакции запись
+    выполняется сразу: поток записи ждал бы ее блокировку.
+    """
+    if (
+        not settings.POSTS_WRITE_COALESCING
+        or transaction.get_connection().in_atomic_block
+    ):
+        return write()
+    # Запись выполнит другой поток, поэтому роутер не заметит ее сам.
+    note_write()
+    future = Future()
+    _get_writer()
+    _queue.put((write, future))
+    return future.result(settings.POSTS_WRITE_TIMEOUT)
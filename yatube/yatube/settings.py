@@ -37,12 +37,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.replicas.ReplicaPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.RepeatedQueriesMiddleware',
 ]
 
 ROOT_URLCONF = 'yatube.urls'
@@ -73,9 +75,49 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Соединение живет между запросами, и PRAGMA из
+        # CORE_SQLITE_PRAGMAS не выполняются на каждом запросе заново.
+        'CONN_MAX_AGE': 60,
     }
 }
 
+DATABASE_ROUTERS = ['core.replicas.ReplicaRouter']
+
+# Реплики для чтения лент и страниц постов. Локально реплика может быть
+# копией db.sqlite3, которую обновляет manage.py sync_replicas --interval:
+#
+# DATABASES['replica'] = {
+#     'ENGINE': 'django.db.backends.sqlite3',
+#     'NAME': os.path.join(BASE_DIR, 'replica.sqlite3'),
+# }
+# CORE_READ_REPLICAS = ('replica',)
+CORE_READ_REPLICAS = ()
+# Приложения, модели которых можно читать из реплик. Сессии, auth и
+# sorl-thumbnail сюда не входят: отставшая реплика разлогинила бы
+# пользователя.
+CORE_REPLICA_APPS = ('posts',)
+# Реплика, отставшая больше чем на столько секунд, не используется;
+# отставание проверяется раз в CORE_REPLICA_CHECK_INTERVAL секунд.
+CORE_REPLICA_MAX_LAG = 30
+CORE_REPLICA_CHECK_INTERVAL = 5
+# Сколько секунд после записи пользователь читает из основной базы. Пока
+# срок не истек, запись могла не дойти до реплики, поэтому он не меньше
+# самого большого допустимого отставания (проверяется core.E001).
+CORE_REPLICA_PIN_SECONDS = CORE_REPLICA_MAX_LAG + CORE_REPLICA_CHECK_INTERVAL
+
+# PRAGMA для каждого нового соединения с SQLite. В режиме WAL читатели
+# не ждут писателя, а synchronous=NORMAL не делает fsync на каждой
+# фиксации. Писатель ждет чужую блокировку busy_timeout мс, а не падает
+# с «database is locked». cache_size < 0 задается в КиБ.
+CORE_SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'memory',
+}
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -120,6 +162,87 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.tiered.TieredCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+            'MAX_BYTES': 32 * 1024 * 1024,
+            'STALENESS': 1,
+        },
+    },
+    'shared': {
+        'BACKEND': 'core.cache.sqlite.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_SIZE': 256 * 1024 * 1024,
+        },
     }
 }
+
+# Счетчики статистики (кэш лент, пакеты записей) копятся в памяти
+# процесса и раз в CORE_COUNTERS_FLUSH_INTERVAL секунд переносятся в
+# общий кэш напрямую, минуя двухуровневый.
+CORE_COUNTERS_CACHE = 'shared'
+CORE_COUNTERS_FLUSH_INTERVAL = 1
+
+# Сколько последних постов хранится в ленте подписок пользователя.
+POSTS_TIMELINE_LENGTH = 1000
+
+# Начиная с этого числа подписчиков посты автора не раскладываются
+# по лентам, а подмешиваются в ленту подписок при чтении.
+POSTS_FANOUT_THRESHOLD = 10000
+# Сколько последних постов популярного автора держать в кэше и как долго.
+POSTS_AUTHOR_RECENT_LENGTH = 200
+POSTS_AUTHOR_RECENT_TIMEOUT = 60 * 60
+
+# Сколько секунд Paginator хранит в кэше число постов в ленте.
+POSTS_PAGINATOR_COUNT_TIMEOUT = 60
+
+# Страницы лент сбрасываются событиями, поэтому TTL может быть долгим.
+POSTS_PAGE_CACHE_TIMEOUT = 60 * 60 * 3
+# После мягкого TTL страницу пересобирает один запрос, остальные получают
+# устаревшую копию; блокировка живет не дольше POSTS_PAGE_CACHE_LOCK.
+POSTS_PAGE_CACHE_SOFT_TIMEOUT = 60 * 5
+POSTS_PAGE_CACHE_LOCK = 10
+POSTS_PAGE_CACHE_LOCK_WAIT = 2
+# Поколения лент и блокировки пересборки пишутся в общий кэш напрямую,
+# минуя память процессов.
+POSTS_SHARED_CACHE = 'shared'
+
+# Метаданные миниатюр sorl читаются через тот же двухуровневый кэш.
+THUMBNAIL_CACHE = 'default'
+
+# Посты в кэше объектов сбрасываются при правке, TTL лишь страхует.
+POSTS_OBJECT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Миниатюры Post.image создаются в пуле потоков после сохранения поста,
+# а не при отрисовке страницы: кадр POSTS_THUMBNAIL_SIZE в нескольких
+# ширинах и форматах. Последний формат — запасной для старых браузеров.
+POSTS_THUMBNAIL_SIZE = (960, 339)
+POSTS_THUMBNAIL_WIDTHS = (320, 640, 960)
+POSTS_THUMBNAIL_FORMATS = ('WEBP', 'JPEG')
+POSTS_THUMBNAIL_SIZES = '(max-width: 992px) 100vw, 720px'
+# 0 — создавать миниатюры сразу, в потоке сохранения.
+POSTS_THUMBNAIL_WORKERS = 2
+
+# Загрузки пишутся во временный файл на диске, а не в память.
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+# Загруженные картинки уменьшаются до этого размера по большей стороне.
+POSTS_IMAGE_MAX_SIZE = 2560
+POSTS_IMAGE_QUALITY = 85
+
+# Поиск N+1: None — выключен, 'log', 'header' или 'raise'. Сообщается о
+# запросах, повторенных из одного места не меньше THRESHOLD раз.
+CORE_REPEATED_QUERIES = None
+CORE_REPEATED_QUERIES_THRESHOLD = 5
+
+# Комментарии и подписки записывает один поток процесса, объединяя
+# записи разных запросов в общие транзакции. Пакет собирается не дольше
+# POSTS_WRITE_BATCH_WAIT секунд и не больше POSTS_WRITE_BATCH_SIZE
+# записей; запрос ждет фиксации своей записи до POSTS_WRITE_TIMEOUT.
+POSTS_WRITE_COALESCING = False
+POSTS_WRITE_BATCH_SIZE = 50
+POSTS_WRITE_BATCH_WAIT = 0.005
+POSTS_WRITE_TIMEOUT = 10
@@ -0,0 +1,16 @@
+"""Настройки для прогона тестов: manage.py test и pytest."""
+from .settings import *  # noqa: F401,F403
+from .settings import CACHES
+
+# Тесты чистят кэш на каждом шаге: им нельзя трогать общий файл кэша
+# машины, а параллельным прогонам — делить его между собой.
+CACHES = {
+    **CACHES,
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'yatube-tests',
+    },
+}
+
+# Тесты сверяют счетчики сразу после событий.
+CORE_COUNTERS_FLUSH_INTERVAL = 0